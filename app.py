@@ -1,13 +1,24 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.io as pio
 from datetime import datetime, timedelta
 from streamlit_gsheets import GSheetsConnection
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+import google_auth_httplib2
+import httplib2
 import base64
+import hashlib
+import heapq
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pandas.io.parsers import TextParser
 from streamlit_echarts import st_echarts, JsCode
 import streamlit.components.v1 as components
 
@@ -36,37 +47,146 @@ def normalize_nip(nip):
     """Remove pontos e espaços do NIP para comparação."""
     return str(nip).replace(".", "").replace(" ", "").strip()
 
+# --- REVISÃO DAS PLANILHAS (DRIVE) ---
+# Consultar a revisão do arquivo no Drive é uma chamada de metadados barata;
+# só vale a pena baixar e processar a aba de novo quando ela mudar.
+
+@st.cache_resource
+def get_drive_service():
+    """Cliente da API do Drive (service account da conexão gsheets), só para metadados."""
+    creds_dict = dict(st.secrets["connections"]["gsheets"])
+    creds = service_account.Credentials.from_service_account_info(
+        creds_dict,
+        scopes=["https://www.googleapis.com/auth/drive.metadata.readonly"]
+    )
+    service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    return {"service": service, "creds": creds}
+
+@st.cache_resource
+def get_sheets_service():
+    """Cliente da API do Sheets (service account da conexão gsheets): batchGet e escrita de células."""
+    creds_dict = dict(st.secrets["connections"]["gsheets"])
+    creds = service_account.Credentials.from_service_account_info(
+        creds_dict,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    service = build("sheets", "v4", credentials=creds, cache_discovery=False)
+    return {"service": service, "creds": creds}
+
+def _id_planilha(spreadsheet):
+    """Extrai o ID da URL da planilha (ou usa a planilha principal da conexão)."""
+    url = spreadsheet or st.secrets["connections"]["gsheets"].get("spreadsheet", "")
+    match = re.search(r"/d/([a-zA-Z0-9-_]+)", url)
+    return match.group(1) if match else url
+
+def _titulo_primeira_aba(cliente, spreadsheet):
+    """Nome da primeira aba (a que o conn.read lê quando não se passa worksheet)."""
+    http = google_auth_httplib2.AuthorizedHttp(cliente["creds"], http=httplib2.Http())
+    meta = cliente["service"].spreadsheets().get(
+        spreadsheetId=_id_planilha(spreadsheet),
+        fields="sheets.properties(title,index)",
+    ).execute(http=http)
+    abas = [aba["properties"] for aba in meta.get("sheets", [])]
+    return min(abas, key=lambda p: p.get("index", 0))["title"]
+
+@st.cache_data(ttl=15, show_spinner=False)
+def revisao_planilha(spreadsheet=None):
+    """
+    Revisão atual da planilha no Drive ("version|modifiedTime").
+    Retorna None se não for possível consultar; nesse caso quem chama
+    volta ao comportamento antigo (baixar sempre).
+    """
+    try:
+        return _consultar_revisao(get_drive_service(), spreadsheet)
+    except Exception as e:
+        print(f"Revisão indisponível ({spreadsheet or 'principal'}): {e}")
+        return None
+
+def _consultar_revisao(cliente, spreadsheet):
+    """files.get de version/modifiedTime, sem cache nem chamadas de interface (usável em threads)."""
+    # Http próprio por requisição: o httplib2 não é seguro entre threads
+    http = google_auth_httplib2.AuthorizedHttp(cliente["creds"], http=httplib2.Http())
+    meta = cliente["service"].files().get(
+        fileId=_id_planilha(spreadsheet),
+        fields="version,modifiedTime",
+        supportsAllDrives=True,
+    ).execute(http=http)
+    return f"{meta.get('version', '')}|{meta.get('modifiedTime', '')}"
+
 def get_users_data():
-    """Busca os dados dos usuários na planilha."""
+    """
+    Busca os dados dos usuários na planilha.
+    Sempre direto da rede (sem cache por revisão): é a base da validação de senha,
+    e a metadata do Drive pode demorar a refletir uma troca de senha recém-gravada.
+    """
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
+        kwargs = {"worksheet": ABA_USUARIOS} if ABA_USUARIOS else {}
         # TTL de 0 para sempre buscar dados frescos ao logar
-        return conn.read(spreadsheet=SHEET_URL, ttl=0)
+        return conn.read(spreadsheet=SHEET_URL, ttl=0, **kwargs)
     except Exception as e:
         st.error(f"Erro ao ler dados da planilha: {e}")
         st.stop()
 
+# Aba da planilha de usuários (NIP na coluna D, senha na E). None = primeira aba,
+# a mesma que o conn.read de get_users_data lê quando não se passa worksheet.
+ABA_USUARIOS = None
+
+def _range_aba(titulo, celulas):
+    """Range A1 qualificado com o nome da aba (aspas simples escapadas)."""
+    return "'" + titulo.replace("'", "''") + "'!" + celulas
+
+def _linha_do_nip(valores, nip):
+    """
+    Linha (1-based, numeração da própria planilha) do NIP na coluna D lida com
+    values.get a partir de D1. Linhas vazias vêm como [] e mantêm a contagem.
+    """
+    for i, celula in enumerate(valores, start=1):
+        if celula and normalize_nip(celula[0]) == nip:
+            return i
+    return None
+
 def update_password(nip, new_password):
-    """Atualiza a senha do usuário na planilha."""
+    """
+    Atualiza a senha do usuário na planilha.
+    Escreve só a célula da coluna E da linha do usuário (values.update), em vez de
+    regravar a aba inteira: é O(1) e duas trocas de senha simultâneas não se sobrescrevem.
+    A linha vem da leitura crua da coluna D da aba (não da posição num DataFrame, que
+    depende do cabeçalho e de linhas em branco), e a célula D da linha é relida logo
+    antes da escrita: se o NIP não bater, nada é gravado.
+    """
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = get_users_data()
-        # Normaliza a coluna de NIP para garantir o match
-        df['NIP_NORM'] = df.iloc[:, 3].apply(normalize_nip) # Coluna D é índice 3
-        
-        # Encontra o índice da linha
-        user_idx = df[df['NIP_NORM'] == normalize_nip(nip)].index
+        nip = normalize_nip(nip)
+        if not nip:
+            return False
+        cliente = get_sheets_service()
+        valores_api = cliente["service"].spreadsheets().values()
+        planilha = _id_planilha(SHEET_URL)
+        aba = ABA_USUARIOS or _titulo_primeira_aba(cliente, SHEET_URL)
+
+        def _ler(celulas):
+            http = google_auth_httplib2.AuthorizedHttp(cliente["creds"], http=httplib2.Http())
+            resposta = valores_api.get(spreadsheetId=planilha, range=_range_aba(aba, celulas)).execute(http=http)
+            return resposta.get("values", [])
+
+        linha = _linha_do_nip(_ler("D:D"), nip)
+        if linha is None:
+            return False
+        # Confere a linha imediatamente antes de gravar (linhas inseridas/removidas no meio)
+        if _linha_do_nip(_ler(f"D{linha}"), nip) != 1:
+            st.error("A planilha de usuários mudou durante a atualização. Tente novamente.")
+            return False
         
-        if not user_idx.empty:
-            # Atualiza a senha (Coluna E é índice 4)
-            df.iloc[user_idx[0], 4] = new_password
-            
-            # Remove a coluna temporária antes de salvar
-            df_to_save = df.drop(columns=['NIP_NORM'])
-            
-            conn.update(spreadsheet=SHEET_URL, data=df_to_save)
-            return True
-        return False
+        http = google_auth_httplib2.AuthorizedHttp(cliente["creds"], http=httplib2.Http())
+        valores_api.update(
+            spreadsheetId=planilha,
+            range=_range_aba(aba, f"E{linha}"),  # Coluna E = senha
+            valueInputOption="RAW",
+            body={"values": [[new_password]]},
+        ).execute(http=http)
+        # A revisão consultada há pouco ficou velha: força nova consulta
+        revisao_planilha.clear()
+        return True
     except Exception as e:
         st.error(f"Erro ao atualizar senha: {e}")
         return False
@@ -838,87 +958,172 @@ def parse_bool(value) -> bool:
         
     return s in ("true", "1", "sim", "yes", "y", "x", "s", "ok", "v", "checked")
 
-def parse_aniversario_date(val):
+def por_valor_distinto(serie, regra, padrao, dtype=object) -> np.ndarray:
     """
-    Parser para datas de aniversário.
-    Aceita datetime objects, strings como '6nov.' ou '15/03'.
-    Retorna uma data com o ano corrente.
+    regra(valor) para a série inteira, avaliada uma vez por valor distinto
+    (tabela de consulta); vazio/NaN recebe `padrao`.
     """
-    if pd.isna(val) or str(val).strip() == "":
-        return pd.NaT
-    
-    ano_atual = (datetime.utcnow() - timedelta(hours=3)).year
-    
-    # Se já for datetime/Timestamp, extrai dia e mês
-    if isinstance(val, (datetime, pd.Timestamp)):
-        try:
-            return datetime(ano_atual, val.month, val.day)
-        except:
-            return pd.NaT
-    
-    s = str(val).strip().lower().replace(".", "")
-    
-    # Tenta parse direto (ex: 2024-03-15 ou 15/03/2024)
-    try:
-        dt = pd.to_datetime(val, dayfirst=True)
-        return datetime(ano_atual, dt.month, dt.day)
-    except:
-        pass
-    
-    # Mapa de meses para formato '6nov'
-    meses = {
-        "jan": 1, "fev": 2, "mar": 3, "abr": 4, "mai": 5, "jun": 6,
-        "jul": 7, "ago": 8, "set": 9, "out": 10, "nov": 11, "dez": 12
-    }
-    
+    codigos, distintos = pd.factorize(serie)  # vazio/NaN -> -1 -> padrao
+    tabela = np.array([regra(v) for v in distintos] + [padrao], dtype=dtype)
+    return tabela[codigos]
+
+def parse_bools(serie) -> np.ndarray:
+    """parse_bool da série inteira, avaliado uma vez por valor distinto."""
+    return por_valor_distinto(serie, parse_bool, False, dtype=bool)
+
+# --- PARSER DE DATAS EM LOTE ---
+# As planilhas repetem as mesmas datas em muitas células: cada texto distinto é
+# convertido uma única vez, tentando os formatos conhecidos em ordem, e o resultado
+# é espalhado de volta para a série inteira sem laço por célula.
+# As funções de célula única (parse_sheet_date etc.) usam o mesmo caminho.
+
+RE_DATA_ISO = r"\d{4}-\d{1,2}-\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"
+FORMATOS_DATA_COMPLETA = ("ISO8601", "%d/%m/%Y", "%d/%m/%y")
+MESES_ABREV_PT = {
+    "jan": 1, "fev": 2, "mar": 3, "abr": 4, "mai": 5, "jun": 6,
+    "jul": 7, "ago": 8, "set": 9, "out": 10, "nov": 11, "dez": 12
+}
+
+def _ano_corrente():
+    return (datetime.utcnow() - timedelta(hours=3)).year
+
+def _textos_distintos(serie):
+    """Texto limpo de cada célula ("" para vazio) fatorado em (códigos, textos distintos)."""
+    texto = serie.map(lambda v: "" if pd.isna(v) else str(v).strip())
+    codigos, distintos = pd.factorize(texto)
+    return codigos, pd.Series(distintos, dtype=object)
+
+def _espalhar(valores, codigos, index):
+    """Leva o resultado calculado por texto distinto de volta a cada célula."""
+    return pd.Series(np.asarray(valores)[codigos], index=index)
+
+def _montar_datas(ano, mes, dia):
+    """Datas a partir de ano/mês/dia (NaT onde faltar algum ou a data não existir)."""
+    partes = pd.DataFrame({"year": ano, "month": mes, "day": dia})
+    return pd.to_datetime(partes, errors="coerce").astype("datetime64[us]")
+
+def _generica(texto):
+    """O parser genérico do pandas (dia primeiro), para textos fora dos formatos conhecidos."""
     try:
-        import re
-        match = re.match(r"(\d+)([a-zç]+)", s)
-        if match:
-            dia = int(match.group(1))
-            mes_str = match.group(2)
-            if mes_str in meses:
-                mes = meses[mes_str]
-                return datetime(ano_atual, mes, dia)
-    except:
-        pass
-        
-    return pd.NaT
+        dt = pd.to_datetime(texto, dayfirst=True, errors="coerce")
+        if pd.notna(dt) and dt.tzinfo is not None:
+            dt = dt.tz_localize(None)
+        return dt
+    except Exception:
+        return pd.NaT
+
+def _datas_de_textos(distintos, formatos=FORMATOS_DATA_COMPLETA):
+    """
+    Converte textos distintos. Retorna (datas, dia, mes):
+    - datas: pelos formatos completos, em ordem (ISO, DD/MM/AAAA, DD/MM/AA);
+      textos que não casam com nenhum formato nem com DD/MM vão para o parser genérico;
+    - dia/mes: preenchidos só para os textos DD/MM (sem ano), que cada parser completa à sua maneira.
+    """
+    datas = pd.Series(pd.NaT, index=distintos.index, dtype="datetime64[us]")
+    iso = distintos.str.fullmatch(RE_DATA_ISO)
+    for fmt in formatos:
+        alvo = datas.isna() & (iso if fmt == "ISO8601" else ~iso)
+        if alvo.any():
+            datas[alvo] = pd.to_datetime(distintos[alvo], format=fmt, errors="coerce")
+    dm = distintos.str.extract(r"^(\d{1,2})/(\d{1,2})$").astype(float)
+    so_dia_mes = dm[0].notna() & datas.isna()
+    for i in np.flatnonzero((datas.isna() & ~so_dia_mes & (distintos != "")).to_numpy()):
+        datas.iloc[i] = _generica(distintos.iloc[i])
+    return datas, dm[0].where(so_dia_mes), dm[1].where(so_dia_mes)
+
+def _corrigir_seculo(datas):
+    """Correção ano 2 dígitos (ex: 25 -> 2025): anos antes de 2000 ganham 100 anos."""
+    antigas = datas.notna() & (datas.dt.year < 2000)
+    if antigas.any():
+        datas = datas.copy()
+        datas[antigas] = datas[antigas] + pd.DateOffset(years=100)
+    return datas
+
+def parse_sheet_dates(serie):
+    """
+    Versão em lote de parse_sheet_date: DD/MM, DD/MM/AA ou DD/MM/AAAA (e ISO).
+    Se não tiver ano (DD/MM), assume o ano atual.
+    """
+    serie = pd.Series(serie)
+    codigos, distintos = _textos_distintos(serie)
+    datas, dia, mes = _datas_de_textos(distintos)
+    datas = _corrigir_seculo(datas)
+    sem_ano = dia.notna()
+    if sem_ano.any():
+        datas[sem_ano] = _montar_datas(_ano_corrente(), mes[sem_ano], dia[sem_ano])
+    return _espalhar(datas.to_numpy(), codigos, serie.index)
 
 def parse_sheet_date(val):
     """
     Tenta converter valor para data, assumindo DD/MM ou DD/MM/YY ou DD/MM/YYYY.
-    Se não tiver ano (DD/MM), assume o ano atual (2025).
+    Se não tiver ano (DD/MM), assume o ano atual.
     """
-    if pd.isna(val) or str(val).strip() == "":
-        return pd.NaT
-    
-    val_str = str(val).strip()
-    
-    # Tenta converter direto (formato padrão do pandas/sheets)
-    try:
-        dt = pd.to_datetime(val_str, dayfirst=True, errors='coerce')
-        if pd.notna(dt):
-            # Correção ano 2 dígitos (ex: 25 -> 2025)
-            if dt.year < 2000:
-                dt = dt.replace(year=dt.year + 100)
-            return dt
-    except:
-        pass
+    return parse_sheet_dates(pd.Series([val], dtype=object)).iloc[0]
 
-    # Tenta formato DD/MM explicitamente
-    try:
-        # Adiciona o ano atual se for apenas DD/MM
-        # Assume ano 2025 para este painel específico (Afastamento 2026 tem dados de 25 e 26)
-        # Melhor estratégia: Tentar parser com ano atual
-        dt = datetime.strptime(val_str, "%d/%m")
-        # Substitui pelo ano corrente ou um ano padrão (2025 neste contexto)
-        dt = dt.replace(year=(datetime.utcnow() - timedelta(hours=3)).year) 
-        return pd.to_datetime(dt)
-    except:
-        pass
-        
-    return pd.NaT
+def parse_aniversario_dates(serie):
+    """
+    Versão em lote de parse_aniversario_date: dia e mês de cada célula no ano corrente.
+    Aceita datas completas, '15/03' ou '6nov.'.
+    """
+    serie = pd.Series(serie)
+    codigos, distintos = _textos_distintos(serie)
+    datas, dia, mes = _datas_de_textos(distintos)
+    dia = dia.where(datas.isna(), datas.dt.day)
+    mes = mes.where(datas.isna(), datas.dt.month)
+    # Formato '6nov' (sem pontos, minúsculo)
+    abrev = distintos.str.lower().str.replace(".", "", regex=False).str.extract(r"^(\d+)([a-zç]+)")
+    falta = dia.isna() & abrev[0].notna()
+    dia = dia.where(~falta, pd.to_numeric(abrev[0], errors="coerce"))
+    mes = mes.where(~falta, abrev[1].map(MESES_ABREV_PT))
+    resultado = _montar_datas(_ano_corrente(), mes, dia)
+    return _espalhar(resultado.to_numpy(), codigos, serie.index)
+
+def parse_aniversario_date(val):
+    """
+    Parser para datas de aniversário.
+    Aceita datetime objects, strings como '6nov.' ou '15/03'.
+    Retorna uma data com o ano corrente.
+    """
+    return parse_aniversario_dates(pd.Series([val], dtype=object)).iloc[0]
+
+def parse_nascimentos(serie):
+    """Datas de nascimento completas; sem ano reconhecível, cai no parser de aniversário."""
+    serie = pd.Series(serie)
+    codigos, distintos = _textos_distintos(serie)
+    datas, _, _ = _datas_de_textos(distintos, formatos=("ISO8601", "%d/%m/%Y"))
+    falta = datas.isna() & (distintos != "")
+    if falta.any():
+        datas[falta] = parse_aniversario_dates(distintos[falta]).to_numpy()
+    return _espalhar(datas.to_numpy(), codigos, serie.index)
+
+def parse_mar_dates(serie, anos):
+    """
+    Versão em lote de parse_mar_date: datas DD/MM recebem o ANO da própria linha,
+    assim como datas com ano 1900.
+    """
+    serie = pd.Series(serie)
+    anos = pd.to_numeric(pd.Series(anos, index=serie.index), errors="coerce")
+    ano_ok = anos.notna() & (anos > 1900)
+    codigos, distintos = _textos_distintos(serie)
+    datas_d, dia_d, mes_d = _datas_de_textos(distintos, formatos=("ISO8601", "%d/%m/%Y"))
+    datas = _espalhar(datas_d.to_numpy(), codigos, serie.index)
+    dia = _espalhar(dia_d.to_numpy(), codigos, serie.index)
+    mes = _espalhar(mes_d.to_numpy(), codigos, serie.index)
+
+    ano_1900 = datas.notna() & (datas.dt.year == 1900) & ano_ok
+    if ano_1900.any():
+        datas[ano_1900] = _montar_datas(anos[ano_1900], datas[ano_1900].dt.month, datas[ano_1900].dt.day).to_numpy()
+    sem_ano = dia.notna()
+    if sem_ano.any():
+        datas[sem_ano] = _montar_datas(anos.where(ano_ok)[sem_ano], mes[sem_ano], dia[sem_ano]).to_numpy()
+    return pd.to_datetime(datas)
+
+def parse_mar_date(val, ano):
+    """
+    Parser específico para Dias de Mar.
+    Se a data for DD/MM, acopla o ANO da linha.
+    """
+    return parse_mar_dates(pd.Series([val], dtype=object), [ano]).iloc[0]
 
 
 def parse_grupos(val):
@@ -939,63 +1144,411 @@ def parse_grupos(val):
     items = [x.strip() for x in s_val.split(",") if x.strip()]
     return items
 
+# --- Tipos compactos ---
+# Texto repetido em toda linha (posto, divisão, motivo...) vira category: cada
+# valor distinto é guardado uma vez e ==/isin/groupby comparam códigos inteiros.
+COLUNAS_CATEGORIA = ("Posto", "Nome", "Divisão", "divisao_key", "Escala", "Serviço", "EqMan", "Motivo", "MotivoAgrupado", "Tipo")
+
+def memoria_mb(df: pd.DataFrame) -> float:
+    """Memória ocupada pelo DataFrame (MB, contando o conteúdo dos textos)."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+def normalizar_tipos(df: pd.DataFrame, bools=()) -> pd.DataFrame:
+    """
+    Converte as colunas de texto de COLUNAS_CATEGORIA em category (só quando os
+    valores se repetem: até metade das linhas distintas) e as colunas de `bools` em
+    bool via parse_bool. A memória antes/depois (MB) fica em df.attrs["memoria_mb"].
+    """
+    antes = memoria_mb(df)
+    df = df.copy()
+    for col in COLUNAS_CATEGORIA:
+        if col not in df.columns:
+            continue
+        serie = df[col]
+        if not (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)):
+            continue
+        if serie.nunique(dropna=True) <= len(serie) // 2:
+            df[col] = serie.astype("category")
+    for col in bools:
+        if col in df.columns:
+            df[col] = parse_bools(df[col])
+    df.attrs["memoria_mb"] = (antes, memoria_mb(df))
+    return df
+
+def versao_dados(df: pd.DataFrame) -> str:
+    """
+    Impressão digital de um DataFrame carregado: df.attrs["versao"], gravada uma vez
+    por carga, ou o hash do conteúdo quando ela não existir. Os caches de dados
+    derivados usam essa chave (parâmetros com _ ficam fora do hash do Streamlit)
+    em vez de hashear o DataFrame inteiro a cada clique.
+    """
+    versao = df.attrs.get("versao")
+    if versao is None:
+        versao = str(int(pd.util.hash_pandas_object(df, index=True).sum()))
+    return versao
+
+# ============================================================
+# 3.0 SNAPSHOTS LOCAIS (STALE-WHILE-REVALIDATE)
+# ============================================================
+
+# Cada aba lida do Google Sheets tem sua última versão boa gravada em disco.
+# Abas da mesma planilha pedidas juntas são buscadas num único batchGet.
+# A leitura devolve o snapshot na hora e atualiza em segundo plano, de modo que
+# reinícios do processo e expiração de TTL não travam a tela, e uma queda de
+# rede não derruba o painel (continua servindo a última versão conhecida).
+# Cada snapshot guarda também a revisão do arquivo no Drive de quando foi baixado:
+# se a revisão atual for a mesma, a verificação em segundo plano nem baixa o grupo.
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots")
+
+@st.cache_resource
+def get_revalidacao_pool():
+    """Pool de threads para as revalidações em segundo plano."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="revalida")
+
+@st.cache_resource
+def get_snapshot_state():
+    """
+    Estado compartilhado pelo processo: grupos com download em andamento (evita
+    duplicados), hora da última verificação de cada grupo e, por grupo, os
+    ao_atualizar de todos os loaders que pediram o grupo enquanto ele estava
+    sendo baixado.
+    """
+    return {"lock": threading.Lock(), "em_andamento": set(), "callbacks": {}, "verificado_em": {}}
+
+def _chave_snapshot(spreadsheet, worksheet, header):
+    bruto = f"{spreadsheet or 'principal'}|{worksheet or ''}|{header}"
+    return hashlib.sha1(bruto.encode("utf-8")).hexdigest()
+
+def _caminho_snapshot(chave):
+    return os.path.join(SNAPSHOT_DIR, f"{chave}.pkl")
+
+def carregar_snapshot(chave):
+    """Retorna o DataFrame salvo para a chave, ou None se não houver snapshot válido."""
+    caminho = _caminho_snapshot(chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        return pd.read_pickle(caminho)
+    except Exception as e:
+        print(f"Snapshot ilegível ({chave}): {e}")
+        return None
+
+def carregar_revisao_snapshot(chave):
+    """Revisão do Drive registrada junto do snapshot, ou None."""
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, f"{chave}.rev"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def salvar_snapshot(chave, df, revisao=None):
+    """Grava o snapshot de forma atômica (arquivo temporário + os.replace)."""
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        caminho = _caminho_snapshot(chave)
+        tmp = f"{caminho}.{threading.get_ident()}.tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, caminho)
+        # Revisão desconhecida: apaga a antiga para não dar o snapshot como atualizado
+        caminho_rev = os.path.join(SNAPSHOT_DIR, f"{chave}.rev")
+        if revisao is None:
+            if os.path.exists(caminho_rev):
+                os.remove(caminho_rev)
+        else:
+            tmp_rev = f"{caminho_rev}.{threading.get_ident()}.tmp"
+            with open(tmp_rev, "w", encoding="utf-8") as f:
+                f.write(revisao)
+            os.replace(tmp_rev, caminho_rev)
+    except Exception as e:
+        print(f"Erro ao gravar snapshot ({chave}): {e}")
+
+# Rótulo que o TextParser dá a colunas sem cabeçalho (com header=None os rótulos são inteiros)
+RE_COLUNA_SEM_NOME = re.compile(r"^Unnamed:\s\d+(?:_level_\d+)?$")
+
+def _coluna_sem_nome(rotulo):
+    return isinstance(rotulo, np.integer) or (isinstance(rotulo, str) and bool(RE_COLUNA_SEM_NOME.search(rotulo)))
+
+def _valores_para_df(valores, header):
+    """
+    Converte a matriz de valores do batchGet no mesmo DataFrame do conn.read, que
+    passa por gspread_dataframe.get_as_dataframe: TextParser sobre a matriz
+    retangular, sem as linhas todas vazias e sem as colunas vazias sem cabeçalho.
+    Sem isso, uma linha ou coluna separadora na aba desloca todas as leituras por posição.
+    """
+    if not valores:
+        return pd.DataFrame()
+    largura = max(len(linha) for linha in valores)
+    linhas = [list(linha) + [""] * (largura - len(linha)) for linha in valores]
+    df = TextParser(linhas, header=header).read()
+    df = df.dropna(how="all", axis=0)
+    vazias = [rotulo for rotulo in df.columns.to_numpy() if _coluna_sem_nome(rotulo) and df[rotulo].isna().all()]
+    return df.drop(columns=vazias) if vazias else df
+
+def _batch_get(spreadsheet, abas, cliente=None):
+    """
+    Lê várias abas da mesma planilha numa única chamada spreadsheets.values.batchGet.
+    Cada requisição usa um Http próprio: o httplib2 não é seguro entre threads
+    (as revalidações rodam em paralelo).
+    """
+    cliente = cliente or get_sheets_service()
+    ranges = ["'" + ws.replace("'", "''") + "'" for ws, _ in abas]
+    http = google_auth_httplib2.AuthorizedHttp(cliente["creds"], http=httplib2.Http())
+    resposta = cliente["service"].spreadsheets().values().batchGet(
+        spreadsheetId=_id_planilha(spreadsheet),
+        ranges=ranges,
+        # Mesma renderização do conn.read: números crus, datas como texto formatado
+        valueRenderOption="UNFORMATTED_VALUE",
+        dateTimeRenderOption="FORMATTED_STRING",
+    ).execute(http=http)
+    value_ranges = resposta.get("valueRanges", [])
+    return {
+        ws: _valores_para_df(value_ranges[i].get("values", []) if i < len(value_ranges) else [], header)
+        for i, (ws, header) in enumerate(abas)
+    }
+
+def _ler_da_rede(spreadsheet, abas, cliente=None):
+    """
+    Única rotina de download das abas (leitura a frio, revalidação e pré-carregamento):
+    um batchGet para o grupo inteiro, com o DataFrame no formato do conn.read
+    (_valores_para_df). Aba None é a primeira aba da planilha, como no conn.read.
+    Só API e pandas, nada de st.*: pode rodar nas threads dos pools, desde que
+    receba o cliente resolvido na thread do script.
+    Retorna {worksheet: DataFrame} com as chaves de `abas`.
+    """
+    cliente = cliente or get_sheets_service()
+    primeira = None
+    nomes = []
+    for ws, header in abas:
+        if not ws:
+            primeira = primeira or _titulo_primeira_aba(cliente, spreadsheet)
+        nomes.append((ws or primeira, header))
+    dados = _batch_get(spreadsheet, tuple(nomes), cliente)
+    return {ws: dados[nome] for (ws, _), (nome, _) in zip(abas, nomes)}
+
+def _registrar_callback(estado, chave_grupo, ao_atualizar):
+    """Anota o ao_atualizar de quem pediu o grupo (chamar com o lock do estado)."""
+    if ao_atualizar is None:
+        return
+    pendentes = estado["callbacks"].setdefault(chave_grupo, [])
+    if ao_atualizar not in pendentes:
+        pendentes.append(ao_atualizar)
+
+def _gravar_grupo(dados, nomes, chaves, revisao):
+    """Grava os snapshots do grupo; True se algum mudou em relação ao anterior."""
+    mudou = False
+    for ws, chave in zip(nomes, chaves):
+        df = dados[ws]
+        anterior = carregar_snapshot(chave)
+        salvar_snapshot(chave, df, revisao)
+        if anterior is None or not df.equals(anterior):
+            mudou = True
+    return mudou
+
+def _encerrar_grupo(estado, chave_grupo, mudou):
+    """
+    Libera o grupo e, se os dados mudaram, chama o ao_atualizar de TODOS os loaders
+    que o pediram durante o download (não só o de quem o agendou).
+    """
+    with estado["lock"]:
+        estado["em_andamento"].discard(chave_grupo)
+        pendentes = estado["callbacks"].pop(chave_grupo, [])
+    if not mudou:
+        return
+    for ao_atualizar in pendentes:
+        try:
+            ao_atualizar()
+        except Exception as e:
+            print(f"Erro ao invalidar cache após revalidação: {e}")
+
+def _revalidar_grupo(chave_grupo, spreadsheet, abas, chaves, estado, cliente_sheets, cliente_drive):
+    """
+    Em segundo plano (revalidação e pré-carregamento): consulta a revisão no Drive e
+    só baixa o grupo se ela for diferente da registrada nos snapshots (ou se não der
+    para consultá-la). Roda na thread do pool: só rede e disco, nada de st.*; os
+    clientes e o estado compartilhado são resolvidos na thread do script.
+    """
+    mudou = False
+    try:
+        revisao = None
+        if cliente_drive is not None:
+            try:
+                revisao = _consultar_revisao(cliente_drive, spreadsheet)
+            except Exception as e:
+                print(f"Revisão indisponível ({spreadsheet or 'principal'}): {e}")
+        if revisao is not None and all(carregar_revisao_snapshot(chave) == revisao for chave in chaves):
+            return
+        dados = _ler_da_rede(spreadsheet, abas, cliente_sheets)
+        mudou = _gravar_grupo(dados, [ws for ws, _ in abas], chaves, revisao)
+    except Exception as e:
+        print(f"Revalidação falhou ({spreadsheet or 'principal'}), mantendo snapshot: {e}")
+    finally:
+        _encerrar_grupo(estado, chave_grupo, mudou)
+
+# Intervalo mínimo entre duas verificações do mesmo grupo (segundos)
+REVALIDACAO_INTERVALO = 60
+
+def ler_planilhas(spreadsheet=None, abas=((None, 0),), ao_atualizar=None, revisao=None):
+    """
+    Lê um grupo de abas da mesma planilha passando pelos snapshots locais.
+    abas: sequência de (worksheet, header). Retorna {worksheet: DataFrame}.
+    - Com snapshot de todas as abas: devolve-os imediatamente, sem ir à rede, e
+      agenda (no máximo uma vez a cada REVALIDACAO_INTERVALO) uma verificação em
+      segundo plano; ela consulta a revisão no Drive e só baixa o grupo se mudou.
+    - Faltando algum (primeira execução): lê o grupo da rede, bloqueando, e grava os snapshots.
+    ao_atualizar: chamado quando a revalidação trouxer dados diferentes do snapshot
+    (ex.: load_data.clear, para o próximo acesso já usar os dados novos). Loaders
+    diferentes que compartilham o grupo têm todos o seu ao_atualizar chamado.
+    revisao: revisão do Drive que quem chama já conhece (caches por revisão). Se algum
+    snapshot foi gravado em outra revisão, o grupo é lido da rede na hora: o snapshot
+    velho não pode ficar guardado sob a revisão nova.
+    """
+    abas = tuple(abas)
+    chaves = [_chave_snapshot(spreadsheet, ws, header) for ws, header in abas]
+    snaps = [carregar_snapshot(chave) for chave in chaves]
+    defasado = revisao is not None and any(carregar_revisao_snapshot(chave) != revisao for chave in chaves)
+
+    if defasado or any(snap is None for snap in snaps):
+        # Consultada antes do download: se o arquivo mudar no meio, a próxima consulta baixa de novo
+        revisao = revisao or revisao_planilha(spreadsheet)
+        dados = _ler_da_rede(spreadsheet, abas)
+        for (ws, _), chave in zip(abas, chaves):
+            salvar_snapshot(chave, dados[ws], revisao)
+        return dados
+
+    atuais = {ws: snap for (ws, _), snap in zip(abas, snaps)}
+    chave_grupo = "|".join(chaves)
+    estado = get_snapshot_state()
+    agora = time.monotonic()
+    with estado["lock"]:
+        em_andamento = chave_grupo in estado["em_andamento"]
+        agendar = not em_andamento and agora - estado["verificado_em"].get(chave_grupo, float("-inf")) >= REVALIDACAO_INTERVALO
+        if agendar:
+            estado["em_andamento"].add(chave_grupo)
+            estado["verificado_em"][chave_grupo] = agora
+        if agendar or em_andamento:
+            # Download já em andamento (revalidação de outra sessão ou pré-carregamento):
+            # entra na lista de quem deve ser avisado quando ele terminar
+            _registrar_callback(estado, chave_grupo, ao_atualizar)
+    if agendar:
+        try:
+            cliente_sheets = get_sheets_service()
+        except Exception as e:
+            print(f"Cliente do Sheets indisponível: {e}")
+            _encerrar_grupo(estado, chave_grupo, False)
+            return atuais
+        try:
+            cliente_drive = get_drive_service()
+        except Exception as e:
+            print(f"Cliente do Drive indisponível: {e}")
+            cliente_drive = None
+        get_revalidacao_pool().submit(_revalidar_grupo, chave_grupo, spreadsheet, abas, chaves, estado, cliente_sheets, cliente_drive)
+    return atuais
+
+def ler_planilha(spreadsheet=None, worksheet=None, header=0, ao_atualizar=None, revisao=None):
+    """Lê uma única aba (atalho para ler_planilhas com um grupo de uma aba)."""
+    return ler_planilhas(spreadsheet, ((worksheet, header),), ao_atualizar=ao_atualizar, revisao=revisao)[worksheet]
+
 # ============================================================
 # 3. CARGA DE DADOS
 # ============================================================
 
 @st.cache_data(ttl=600, show_spinner="Carregando dados de efetivo...")
 def load_data():
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    df = conn.read(worksheet="Afastamento 2026", header=HEADER_ROW, ttl="10m")
+    df = ler_planilha(worksheet="Afastamento 2026", header=HEADER_ROW, ao_atualizar=load_data.clear)
     if "Nome" in df.columns:
         df = df.dropna(subset=["Nome"])
-    df = df.reset_index(drop=True)
+    df = normalizar_tipos(df.reset_index(drop=True))
+    # Impressão digital desta carga (revisão no Drive + hora): chave dos caches derivados
+    df.attrs["versao"] = f"{revisao_planilha() or '-'}|{time.time_ns()}"
     return df
 
-@st.cache_data(ttl=3600, show_spinner="Carregando aniversariantes...")
-def load_aniversarios():
-    """Carrega dados de aniversários"""
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    df = conn.read(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ttl="1h")
-    
+# Posições (0-based) das colunas da aba TRIPULAÇÃO (header na linha 7)
+COLUNAS_TRIPULACAO = {
+    "Posto": 3,       # D
+    "Nome": 5,        # F (nome completo)
+    "Guerra": 6,      # G (nome de guerra)
+    "IS": 10,         # K (validade da inspeção de saúde)
+    "Nascimento": 12, # M
+    "Embarque": 15,   # P
+    "Divisão": 16,    # Q
+    "Situação": 17,   # R
+}
+
+def _limpar_cache_tripulacao():
+    load_tripulacao_raw.clear()
+    load_tripulacao.clear()
+
+@st.cache_data(ttl=3600, show_spinner="Carregando tripulação...")
+def load_tripulacao_raw():
+    """Lê a aba TRIPULAÇÃO uma única vez (ficha completa, nomes de colunas sem espaços extras)."""
+    # Header na linha 7 (index 6). Dados começam na 8.
+    df = ler_planilha(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ao_atualizar=_limpar_cache_tripulacao)
+    df.columns = [str(c).strip() for c in df.columns]
     return df
 
-def parse_mar_date(val, ano):
+def _texto_celula(serie):
+    """Texto limpo da coluna: vazio para NaN/'nan'."""
+    texto = serie.astype(str).str.strip()
+    return texto.where(serie.notna() & (texto.str.lower() != "nan"), "")
+
+def _limpar_nip(val):
+    """NIP só com dígitos (remove '.0' do float, pontos, hífens e espaços)."""
+    nip = str(val).strip()
+    if nip.endswith(".0"):
+        nip = nip[:-2]
+    return nip.replace(".", "").replace("-", "").replace(" ", "")
+
+@st.cache_data(ttl=3600, show_spinner="Processando tripulação...")
+def load_tripulacao():
     """
-    Parser específico para Dias de Mar.
-    Se a data for DD/MM, acopla o ANO da linha.
+    Tripulação tipada, construída uma vez por atualização da aba TRIPULAÇÃO.
+    Colunas: Posto, Nome, Guerra, NIP, Nascimento, IS, ISTexto, Embarque, Divisão, Situação
+    e Descricao ("Posto Guerra", usada nos selects e listas).
+    O índice é o mesmo de load_tripulacao_raw(), para cruzar com a ficha completa.
     """
-    if pd.isna(val) or str(val).strip() == "":
-        return pd.NaT
-    
-    s_val = str(val).strip()
-    
-    # 1. Tenta parse direto (ex: 15/02/2024)
-    try:
-        dt = pd.to_datetime(s_val, dayfirst=True)
-        # Se o ano for 1900 (comum quando se passa só dia/mês), tenta corrigir com o ANO da linha
-        if dt.year == 1900 and pd.notna(ano) and int(ano) > 1900:
-            return dt.replace(year=int(ano))
-        return dt
-    except:
-        pass
-        
-    # 2. Tenta concatenar com o ANO (ex: 15/02 + 2024 -> 15/02/2024)
-    if pd.notna(ano) and int(ano) > 1900:
-        try:
-            full_date = f"{s_val}/{int(ano)}"
-            return pd.to_datetime(full_date, dayfirst=True)
-        except:
-            pass
-            
-    return pd.NaT
+    df = load_tripulacao_raw()
+    vazio = pd.Series(pd.NA, index=df.index, dtype=object)
+
+    def coluna(nome):
+        pos = COLUNAS_TRIPULACAO[nome]
+        return df.iloc[:, pos] if pos < len(df.columns) else vazio
+
+    roster = pd.DataFrame(index=df.index)
+    for nome in ["Posto", "Nome", "Guerra", "Divisão", "Situação"]:
+        roster[nome] = _texto_celula(coluna(nome))
+
+    col_nip = next((c for c in df.columns if "NIP" in str(c).upper()), None)
+    if col_nip is not None:
+        roster["NIP"] = df[col_nip].where(df[col_nip].notna(), "").map(_limpar_nip)
+    else:
+        roster["NIP"] = ""
+
+    roster["Nascimento"] = parse_nascimentos(coluna("Nascimento"))
+    roster["ISTexto"] = _texto_celula(coluna("IS"))
+    # Cada texto distinto no parser em lote: formatos misturados na coluna não viram NaT
+    roster["IS"] = parse_sheet_dates(roster["ISTexto"])
+    roster["Embarque"] = parse_sheet_dates(coluna("Embarque"))
+
+    nome_exibir = roster["Guerra"].where(roster["Guerra"] != "", roster["Nome"])
+    roster["Descricao"] = (roster["Posto"] + " " + nome_exibir).where(roster["Posto"] != "", nome_exibir)
+    return roster
 
-@st.cache_data(ttl=0, show_spinner="Carregando dados de Mar...")
 def load_dias_mar():
-    """Carrega dados da planilha separada de Dias de Mar"""
-    conn = st.connection("gsheets", type=GSheetsConnection)
+    """Carrega dados da planilha separada de Dias de Mar (reprocessa só se a revisão mudar)."""
+    revisao = revisao_planilha(URL_DIAS_MAR)
+    if revisao is None:
+        return _processar_dias_mar()
+    return _load_dias_mar_na_revisao(revisao)
+
+# ttl: rede de segurança; a chave por revisão já garante dados novos quando a planilha muda
+@st.cache_data(ttl=3600, max_entries=2, show_spinner="Carregando dados de Mar...")
+def _load_dias_mar_na_revisao(revisao):
+    return _processar_dias_mar(revisao)
+
+def _processar_dias_mar(revisao=None):
     # Header na linha 8 (index 7)
-    df = conn.read(spreadsheet=URL_DIAS_MAR, header=7, ttl="10m")
+    # Com a revisão conhecida, snapshot de outra revisão é relido da rede antes de entrar no cache
+    df = ler_planilha(spreadsheet=URL_DIAS_MAR, header=7, ao_atualizar=_load_dias_mar_na_revisao.clear, revisao=revisao)
     
     # Limpeza: Remove linhas onde "TERMO DE VIAGEM" está vazio
     if "TERMO DE VIAGEM" in df.columns:
@@ -1018,13 +1571,27 @@ def load_dias_mar():
     date_cols = ["DATA INÍCIO", "DATA TÉRMINO"]
     for col in date_cols:
         if col in df.columns and "ANO" in df.columns:
-            df[col] = df.apply(lambda row: parse_mar_date(row[col], row["ANO"]), axis=1)
+            df[col] = parse_mar_dates(df[col], df["ANO"])
         elif col in df.columns:
             # Fallback se não tiver coluna ANO
             df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce')
             
     return df
 
+def _limpar_cache_ausencias():
+    load_planilha_ausencias.clear()
+    load_metas.clear()
+    load_datas_importantes.clear()
+
+@st.cache_data(ttl=600, show_spinner="Carregando planilha de ausências...")
+def load_planilha_ausencias():
+    """Abas Metas e Datas_importantes da planilha de ausências, lidas juntas."""
+    return ler_planilhas(
+        URL_AUSENCIAS,
+        (("Metas", None), ("Datas_importantes", None)),
+        ao_atualizar=_limpar_cache_ausencias,
+    )
+
 @st.cache_data(ttl=600, show_spinner="Carregando metas de férias...")
 def load_metas():
     """Carrega dados da aba Metas da planilha de ausências.
@@ -1033,8 +1600,7 @@ def load_metas():
     Coluna C (linha 1): ano de referência
     """
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(spreadsheet=URL_AUSENCIAS, worksheet="Metas", header=None, ttl="10m")
+        df = load_planilha_ausencias()["Metas"]
         if df is None or df.empty:
             return pd.DataFrame(), None
         # Ano de referência: célula C1 (index [0, 2])
@@ -1073,8 +1639,7 @@ def load_datas_importantes():
     Coluna C: Data Fim
     """
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(spreadsheet=URL_AUSENCIAS, worksheet="Datas_importantes", header=None, ttl="10m")
+        df = load_planilha_ausencias()["Datas_importantes"]
         if df is None or df.empty:
             return pd.DataFrame()
         
@@ -1103,20 +1668,105 @@ def load_datas_importantes():
         print(f"Erro ao carregar datas importantes: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=0, show_spinner="Carregando Tabela do Dia...")
 def load_tabela_servico_dia():
-    """Carrega as abas TABELA 1, 2 e 3 para encontrar a escala do dia."""
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    sheets = ["TABELA 1", "TABELA 2", "TABELA 3"]
-    data = {}
-    for sheet in sheets:
-        try:
-            # Lê sem header para pegar posições exatas (A1 é 0,0)
-            df = conn.read(spreadsheet=URL_TABELA_SERVICO, worksheet=sheet, header=None, ttl=0)
-            data[sheet] = df
-        except Exception as e:
-            print(f"Erro ao ler {sheet}: {e}")
-    return data
+    """Carrega as abas TABELA 1, 2 e 3 para encontrar a escala do dia (rebaixa só se a revisão mudar)."""
+    revisao = revisao_planilha(URL_TABELA_SERVICO)
+    if revisao is None:
+        return _ler_tabelas_servico()
+    return _load_tabela_servico_na_revisao(revisao)
+
+@st.cache_data(ttl=3600, max_entries=2, show_spinner="Carregando Tabela do Dia...")
+def _load_tabela_servico_na_revisao(revisao):
+    return _ler_tabelas_servico(revisao)
+
+def _ler_tabelas_servico(revisao=None):
+    # Lê sem header para pegar posições exatas (A1 é 0,0); as três abas num único batchGet
+    abas = [(sheet, None) for sheet in ("TABELA 1", "TABELA 2", "TABELA 3")]
+    try:
+        return ler_planilhas(URL_TABELA_SERVICO, abas, ao_atualizar=_load_tabela_servico_na_revisao.clear, revisao=revisao)
+    except Exception as e:
+        print(f"Erro ao ler tabelas de serviço: {e}")
+        return {}
+
+# Abas da planilha de adestramento (usadas pela página Adestramento e por Dados Pessoais)
+ABAS_ADESTRAMENTO = (("GERAL - OFICIAIS", None), ("GERAL - PRAÇAS", None), ("PQS", None))
+
+def load_adestramento():
+    """Abas GERAL - OFICIAIS, GERAL - PRAÇAS e PQS, lidas num único batchGet."""
+    return ler_planilhas(URL_ADESTRAMENTO, ABAS_ADESTRAMENTO, ao_atualizar=load_matriz_adestramento.clear)
+
+def _matriz_cursos(df_sheet, col_fim):
+    """
+    Converte uma aba GERAL (header=None) em matriz booleana militar × curso.
+    Layout: requisitos na linha 3 (index 2), nomes dos cursos na linha 7 (index 6),
+    militares a partir da linha 8 (index 7): NIP na coluna B, Guerra na C, Completo na D,
+    cursos da coluna E (index 4) até col_fim (exclusivo), "1" = curso concluído.
+    """
+    n_col = max(4, min(col_fim, df_sheet.shape[1]))
+    cursos = df_sheet.iloc[6, 4:n_col].map(str).str.strip().to_numpy()
+    requisitos = pd.to_numeric(df_sheet.iloc[2, 4:n_col], errors="coerce").fillna(0).astype(int).to_numpy()
+    pessoas = df_sheet.iloc[7:]
+    celulas = pessoas.iloc[:, 4:n_col].map(lambda v: str(v).strip())
+    guerras = pessoas.iloc[:, 2].map(str).str.strip()
+    curso_valido = (cursos != "") & (pd.Series(cursos).str.lower() != "nan").to_numpy()
+    matriz = celulas.isin(["1", "1.0"]).to_numpy() & curso_valido
+    ativos = ((guerras != "") & (guerras.str.lower() != "nan")).to_numpy()
+    # Cursos com nome repetido somam todos na primeira ocorrência (como cursos.index(c))
+    primeira_col = pd.Series(np.arange(len(cursos))).groupby(cursos).transform("min").to_numpy()
+    totais = np.bincount(primeira_col, weights=matriz[ativos].sum(axis=0), minlength=len(cursos)).astype(int)
+    return {
+        "cursos": cursos,
+        "requisitos": requisitos,
+        "curso_valido": curso_valido,
+        "nips": pessoas.iloc[:, 1].map(_limpar_nip).to_numpy(),
+        "guerras": guerras.to_numpy(),
+        "completos": pessoas.iloc[:, 3].map(str).str.strip().to_numpy(),
+        "ativos": ativos,
+        "matriz": matriz,
+        "totais": totais,
+    }
+
+@st.cache_data(ttl=600, show_spinner="Processando adestramento...")
+def load_matriz_adestramento():
+    """Matrizes de cursos de oficiais (colunas E:AF) e praças (colunas E:BI)."""
+    abas = load_adestramento()
+    return {
+        "oficiais": _matriz_cursos(abas["GERAL - OFICIAIS"], 32),
+        "pracas": _matriz_cursos(abas["GERAL - PRAÇAS"], 61),
+    }
+
+def resumo_cursos(m):
+    """Tabela Curso/Real/Requisito dos cursos válidos e as listas de déficit, excesso e RMC."""
+    df = pd.DataFrame({
+        "Curso": m["cursos"],
+        "Real": m["totais"],
+        "Requisito": m["requisitos"],
+    })[m["curso_valido"]].reset_index(drop=True)
+    deficit = df[df["Real"] < df["Requisito"]]
+    excesso = df[df["Real"] > df["Requisito"]]
+    rmc = df[(df["Real"] == df["Requisito"]) & (df["Requisito"] > 0)]
+    return df, deficit, excesso, rmc
+
+def cursos_da_linha(m, i):
+    """Cursos concluídos pelo militar da linha i da matriz, na ordem das colunas."""
+    return m["cursos"][m["matriz"][i]].tolist()
+
+def buscar_militar_matriz(m, nip, nome_completo, nome_guerra, texto_selecao):
+    """
+    Linha do militar na matriz (ou None): pelo NIP quando houver; sem NIP, por nome
+    completo, nome de guerra, ou nome de guerra contido no texto selecionado.
+    """
+    if nip:
+        achados = np.flatnonzero((m["nips"] == nip) & (m["nips"] != ""))
+    else:
+        guerras = pd.Series(m["guerras"]).str.upper()
+        completos = pd.Series(m["completos"]).str.upper()
+        achados = np.flatnonzero(
+            ((completos == nome_completo) & (nome_completo != "")).to_numpy()
+            | ((guerras == nome_guerra) & (nome_guerra != "")).to_numpy()
+            | np.array([g in texto_selecao for g in guerras], dtype=bool)
+        )
+    return int(achados[0]) if len(achados) else None
 
 
 
@@ -1124,9 +1774,8 @@ def load_tabela_servico_dia():
 @st.cache_data(ttl=3600, show_spinner="Carregando cardápio...")
 def load_cardapio():
     """Carrega dados do cardápio semanal"""
-    conn = st.connection("gsheets", type=GSheetsConnection)
     # Lê sem cabeçalho para pegar a estrutura exata
-    df = conn.read(spreadsheet=URL_CARDAPIO, header=None, ttl="1h")
+    df = ler_planilha(spreadsheet=URL_CARDAPIO, header=None, ao_atualizar=load_cardapio.clear)
     return df
 
 
@@ -1134,9 +1783,8 @@ def load_cardapio():
 @st.cache_data(ttl=600, show_spinner="Carregando Tabela de Lotação...")
 def load_lotacao_data():
     """Carrega dados da Tabela de Lotação com layout fixo (hardcoded)"""
-    conn = st.connection("gsheets", type=GSheetsConnection)
     # Lê sem header para pegar pela posição
-    df = conn.read(spreadsheet=URL_LOTACAO, header=None, ttl="10m")
+    df = ler_planilha(spreadsheet=URL_LOTACAO, header=None, ao_atualizar=load_lotacao_data.clear)
     
     # 1. Seleção de Colunas por Posição
     # Coluna 0 -> Especialidade
@@ -1177,39 +1825,251 @@ def load_lotacao_data():
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=300)
+@st.cache_resource
+def get_calendar_client():
+    """
+    Cliente do Calendar único no processo, montado na primeira chamada.
+    Usa o documento de descoberta embutido na biblioteca (sem baixar nem reprocessar
+    a cada cache miss) e uma única sessão HTTP autorizada com keep-alive.
+    O httplib2 não é seguro entre threads: as chamadas passam pelo lock.
+    """
+    creds_dict = dict(st.secrets["connections"]["gsheets"])
+    creds = service_account.Credentials.from_service_account_info(
+        creds_dict,
+        scopes=["https://www.googleapis.com/auth/calendar.readonly"]
+    )
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=30))
+    service = build("calendar", "v3", http=http, static_discovery=True, cache_discovery=False)
+    return {"service": service, "lock": threading.Lock()}
+
+# --- ARMAZÉM LOCAL DE EVENTOS (SYNC INCREMENTAL) ---
+# Cada agenda é baixada por completo uma vez; depois só as alterações são puxadas
+# com o syncToken do Calendar. Visões de mês, "Eventos de Hoje" e qualquer outro
+# intervalo são recortes locais do armazém: o tráfego acompanha as edições, não as visitas.
+AGENDA_SYNC_INTERVALO = 60  # segundos mínimos entre sincronizações da mesma agenda
+AGENDA_BACKOFF_MAX = 900    # teto da espera entre tentativas após falhas seguidas
+
+@st.cache_resource
+def get_agenda_store():
+    """
+    Armazém de eventos do processo: {calendar_id: {"eventos", "sync_token", "ultima_sync", "falhas"}}
+    e as sincronizações em andamento ({calendar_id: threading.Event}).
+    """
+    return {"lock": threading.Lock(), "agendas": {}, "em_andamento": {}}
+
+def _caminho_agenda(calendar_id):
+    chave = hashlib.sha1(calendar_id.encode("utf-8")).hexdigest()
+    return os.path.join(SNAPSHOT_DIR, f"agenda_{chave}.pkl")
+
+def _carregar_agenda_disco(calendar_id):
+    """Armazém gravado em disco (sobrevive a reinícios), ou um armazém vazio."""
+    caminho = _caminho_agenda(calendar_id)
+    if os.path.exists(caminho):
+        try:
+            agenda = pd.read_pickle(caminho)
+            agenda["ultima_sync"] = 0.0
+            return agenda
+        except Exception as e:
+            print(f"Armazém de agenda ilegível ({calendar_id}): {e}")
+    return {"eventos": {}, "sync_token": None, "ultima_sync": 0.0}
+
+def _salvar_agenda_disco(calendar_id, agenda):
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        caminho = _caminho_agenda(calendar_id)
+        tmp = f"{caminho}.{threading.get_ident()}.tmp"
+        pd.to_pickle({"eventos": agenda["eventos"], "sync_token": agenda["sync_token"]}, tmp)
+        os.replace(tmp, caminho)
+    except Exception as e:
+        print(f"Erro ao gravar armazém de agenda ({calendar_id}): {e}")
+
+def _resumir_evento(item):
+    """Guarda só o que as telas usam, com início/fim já convertidos para UTC."""
+    start = item["start"].get("dateTime", item["start"].get("date"))
+    end = item.get("end", {}).get("dateTime", item.get("end", {}).get("date", start))
+    inicio = pd.to_datetime(start, utc=True)
+    fim = pd.to_datetime(end, utc=True)
+    return {
+        "Evento": item.get("summary", "Sem título"),
+        "Descricao": item.get("description", ""),
+        "StartRaw": start,
+        "Inicio": inicio,
+        "Fim": fim if fim > inicio else inicio,
+    }
+
+def _aplicar_itens(eventos, items):
+    for item in items:
+        if item.get("status") == "cancelled":
+            eventos.pop(item["id"], None)
+        else:
+            try:
+                eventos[item["id"]] = _resumir_evento(item)
+            except Exception as e:
+                print(f"Evento ignorado ({item.get('id')}): {e}")
+
+def _listar_paginas(cliente, params, resposta=None):
+    """Percorre as páginas de events().list; retorna (itens, nextSyncToken)."""
+    service = cliente["service"]
+    if resposta is None:
+        with cliente["lock"]:
+            resposta = service.events().list(**params).execute()
+    items = list(resposta.get("items", []))
+    while resposta.get("nextPageToken"):
+        with cliente["lock"]:
+            resposta = service.events().list(**params, pageToken=resposta["nextPageToken"]).execute()
+        items.extend(resposta.get("items", []))
+    return items, resposta.get("nextSyncToken")
+
+def _sincronizacao_completa(cliente, calendar_id):
+    items, token = _listar_paginas(cliente, {"calendarId": calendar_id, "singleEvents": True, "maxResults": 2500})
+    eventos = {}
+    _aplicar_itens(eventos, items)
+    return {"eventos": eventos, "sync_token": token, "ultima_sync": 0.0}
+
+def _intervalo_agenda(agenda):
+    """Espera mínima até a próxima sincronização: dobra a cada falha seguida, até AGENDA_BACKOFF_MAX."""
+    return min(AGENDA_SYNC_INTERVALO * 2 ** agenda.get("falhas", 0), AGENDA_BACKOFF_MAX)
+
+def _buscar_alteracoes(cliente, tokens):
+    """
+    Rede, fora do lock do armazém: {cal_id: token ou None} -> {cal_id: (tipo, dados)},
+    tipo "completa" (agenda nova), "incremental" ((itens, token)) ou "erro" (exceção).
+    Incrementais vão todas num único BatchHttpRequest; sem token ou token expirado
+    (HTTP 410) fazem a sincronização completa.
+    """
+    service = cliente["service"]
+    incrementais = [c for c, token in tokens.items() if token]
+    respostas = {}
+
+    def _ao_receber(request_id, response, exception):
+        respostas[incrementais[int(request_id)]] = (response, exception)
+
+    if incrementais:
+        batch = service.new_batch_http_request(callback=_ao_receber)
+        for i, cal_id in enumerate(incrementais):
+            batch.add(
+                service.events().list(
+                    calendarId=cal_id,
+                    syncToken=tokens[cal_id],
+                    singleEvents=True,
+                    maxResults=2500
+                ),
+                request_id=str(i)
+            )
+        try:
+            with cliente["lock"]:
+                batch.execute()
+        except Exception as e:
+            # Falha do lote inteiro: todas as incrementais contam como falha
+            respostas = {cal_id: (None, e) for cal_id in incrementais}
+
+    resultados = {}
+    for cal_id, token in tokens.items():
+        try:
+            resposta, erro = respostas.get(cal_id, (None, None))
+            if not token or (isinstance(erro, HttpError) and erro.resp.status == 410):
+                # Primeira vez ou token expirado: baixa tudo de novo
+                resultados[cal_id] = ("completa", _sincronizacao_completa(cliente, cal_id))
+            elif erro is not None:
+                raise erro
+            else:
+                params = {"calendarId": cal_id, "syncToken": token, "singleEvents": True, "maxResults": 2500}
+                resultados[cal_id] = ("incremental", _listar_paginas(cliente, params, resposta))
+        except Exception as e:
+            resultados[cal_id] = ("erro", e)
+    return resultados
+
+def sincronizar_agendas(calendar_ids):
+    """
+    Atualiza o armazém das agendas pedidas (no máximo uma vez por AGENDA_SYNC_INTERVALO).
+    O lock do armazém só é segurado para escolher as pendentes (copiando seus tokens)
+    e para trocar os resultados: a rede roda fora dele, então uma sincronização lenta
+    não trava eventos_agenda nas outras sessões. Cada agenda tem no máximo uma
+    sincronização em andamento; quem chega enquanto isso usa o armazém atual (ou
+    espera, se a agenda ainda nunca foi baixada). Falhas registram a hora e o
+    intervalo até a próxima tentativa dobra (_intervalo_agenda).
+    """
+    store = get_agenda_store()
+    agora = time.time()
+    tokens, aguardar = {}, []
+    with store["lock"]:
+        for cal_id in calendar_ids:
+            if cal_id not in store["agendas"]:
+                store["agendas"][cal_id] = _carregar_agenda_disco(cal_id)
+            agenda = store["agendas"][cal_id]
+            if cal_id in store["em_andamento"]:
+                if not agenda["sync_token"]:
+                    aguardar.append(store["em_andamento"][cal_id])
+            elif agora - agenda["ultima_sync"] >= _intervalo_agenda(agenda):
+                tokens[cal_id] = agenda["sync_token"]
+                store["em_andamento"][cal_id] = threading.Event()
+
+    if tokens:
+        try:
+            resultados = _buscar_alteracoes(get_calendar_client(), tokens)
+        except Exception as e:
+            resultados = {cal_id: ("erro", e) for cal_id in tokens}
+        gravar = []
+        with store["lock"]:
+            try:
+                for cal_id in tokens:
+                    anterior = store["agendas"][cal_id]
+                    tipo, dados = resultados[cal_id]
+                    if tipo == "erro":
+                        print(f"Erro ao sincronizar agenda {cal_id}: {dados}")
+                        # Guarda a hora da falha: a próxima tentativa espera o backoff
+                        store["agendas"][cal_id] = dict(anterior, ultima_sync=agora, falhas=anterior.get("falhas", 0) + 1)
+                        continue
+                    if tipo == "completa":
+                        agenda = dict(dados, ultima_sync=agora, falhas=0)
+                    else:
+                        items, token = dados
+                        eventos = dict(anterior["eventos"])
+                        _aplicar_itens(eventos, items)
+                        agenda = {"eventos": eventos, "sync_token": token or anterior["sync_token"], "ultima_sync": agora, "falhas": 0}
+                    store["agendas"][cal_id] = agenda
+                    gravar.append((cal_id, agenda))
+            finally:
+                for cal_id in tokens:
+                    store["em_andamento"].pop(cal_id).set()
+        for cal_id, agenda in gravar:
+            _salvar_agenda_disco(cal_id, agenda)
+
+    for evento in aguardar:
+        evento.wait(timeout=30)
+
+def eventos_agenda(calendar_id, inicio, fim=None, limite=None):
+    """
+    Recorte local do armazém: eventos que terminam depois de `inicio` e começam
+    antes de `fim` (mesma regra de timeMin/timeMax da API), ordenados pelo início.
+    """
+    inicio = pd.to_datetime(inicio, utc=True)
+    fim = pd.to_datetime(fim, utc=True) if fim is not None else None
+    store = get_agenda_store()
+    with store["lock"]:
+        agenda = store["agendas"].get(calendar_id)
+        eventos = list(agenda["eventos"].values()) if agenda else []
+    selecionados = [
+        ev for ev in eventos
+        if ev["Fim"] > inicio and (fim is None or ev["Inicio"] < fim)
+    ]
+    selecionados.sort(key=lambda ev: ev["Inicio"])
+    return selecionados[:limite] if limite else selecionados
+
 def load_calendar_events(calendar_id: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
     try:
-        creds_dict = dict(st.secrets["connections"]["gsheets"])
-        creds = service_account.Credentials.from_service_account_info(
-            creds_dict,
-            scopes=["https://www.googleapis.com/auth/calendar.readonly"]
-        )
-        service = build("calendar", "v3", credentials=creds)
+        sincronizar_agendas([calendar_id])
         
         if not start_date:
             start_date = datetime.utcnow().isoformat() + "Z"
             
-        # Parâmetros da query
-        query_params = {
-            "calendarId": calendar_id,
-            "timeMin": start_date,
-            "singleEvents": True,
-            "orderBy": "startTime"
-        }
-        
-        if end_date:
-            query_params["timeMax"] = end_date
-        else:
-            query_params["maxResults"] = 30 # Limite padrão se não houver data fim
-            
-        events_result = service.events().list(**query_params).execute()
-        events = events_result.get("items", [])
+        # Sem data fim: limite padrão de 30 eventos
+        events = eventos_agenda(calendar_id, start_date, end_date, limite=None if end_date else 30)
         data = []
         for event in events:
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            summary = event.get("summary", "Sem título")
-            description = event.get("description", "")
+            start = event["StartRaw"]
+            summary = event["Evento"]
+            description = event["Descricao"]
             try:
                 dt_obj = pd.to_datetime(start)
                 fmt = "%d/%m %H:%M" if "T" in start else "%d/%m"
@@ -1224,37 +2084,19 @@ def load_calendar_events(calendar_id: str, start_date: str = None, end_date: str
     except Exception:
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600, show_spinner="Carregando tempo de bordo...")
 def load_tempo_bordo():
-    """Carrega dados de tempo de embarque da planilha de Tripulação."""
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    # Header na linha 7 (index 6). Dados começam na 8.
-    df = conn.read(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ttl="1h")
-    
-    # Coluna P é index 15. Vamos pegar pelo nome se possível, ou index fallback.
-    # Se header=7 lê a linha 8 como header. A coluna P deve ter um título.
-    # Se não tiver, acessamos por iloc.
-    col_data = None
-    if len(df.columns) > 15:
-        col_data = df.iloc[:, 15] # Coluna P
-    
-    if col_data is None:
+    """Datas de embarque (coluna P da aba TRIPULAÇÃO), já convertidas."""
+    embarque = load_tripulacao()["Embarque"].dropna()
+    if embarque.empty:
         return pd.DataFrame()
-        
-    return pd.DataFrame({"DataEmbarque": col_data})
+    return pd.DataFrame({"DataEmbarque": embarque})
 
-@st.cache_data(ttl=300)
 def get_events_today_all_calendars():
-    """Busca eventos de HOJE em todas as agendas configuradas."""
+    """Busca eventos de HOJE em todas as agendas configuradas (recorte do armazém local)."""
     all_events = []
     
     try:
-        creds_dict = dict(st.secrets["connections"]["gsheets"])
-        creds = service_account.Credentials.from_service_account_info(
-            creds_dict,
-            scopes=["https://www.googleapis.com/auth/calendar.readonly"]
-        )
-        service = build("calendar", "v3", credentials=creds)
+        sincronizar_agendas(list(AGENDAS_OFICIAIS.values()))
         
         # Intervalo de HOJE (00:00 até 23:59:59)
         # Ajuste de fuso horário pode ser necessário dependendo do servidor, 
@@ -1266,21 +2108,13 @@ def get_events_today_all_calendars():
         
         for nome_agenda, cal_id in AGENDAS_OFICIAIS.items():
             try:
-                events_result = service.events().list(
-                    calendarId=cal_id, 
-                    timeMin=start_of_day, 
-                    timeMax=end_of_day,
-                    singleEvents=True, 
-                    orderBy="startTime"
-                ).execute()
-                
-                items = events_result.get("items", [])
+                items = eventos_agenda(cal_id, start_of_day, end_of_day)
                 color = AGENDA_COLORS.get(nome_agenda, "#999999")
                 
                 for item in items:
-                    start = item["start"].get("dateTime", item["start"].get("date"))
-                    summary = item.get("summary", "Sem título")
-                    description = item.get("description", "")
+                    start = item["StartRaw"]
+                    summary = item["Evento"]
+                    description = item["Descricao"]
                     
                     # Formatação de hora
                     try:
@@ -1316,12 +2150,60 @@ def get_events_today_all_calendars():
         
     return all_events
 
-try:
-    df_raw = load_data()
-    # Carregamento dos dados de mar é feito sob demanda na aba para economizar recurso inicial
-except Exception as e:
-    st.error(f"Erro de conexão principal: {e}")
-    st.stop()
+# ============================================================
+# 3.1 PRÉ-CARREGAMENTO PARALELO DAS PLANILHAS
+# ============================================================
+
+# Grupos de abas lidos pelos loaders (mesmos spreadsheet/abas/header de cada ler_planilha(s)).
+# O pré-carregamento não chama os loaders: eles usam st.cache_data, spinner e
+# st.connection, que fora da thread do script perdem o ScriptRunContext (avisos no
+# log e erros engolidos). Em vez disso, cada grupo passa pela mesma verificação da
+# revalidação (_revalidar_grupo -> _ler_da_rede, só API) e grava os snapshots locais;
+# quando a página chamar o loader, ler_planilhas encontra o snapshot e não vai à rede.
+PREFETCH_GRUPOS = (
+    (None, (("Afastamento 2026", HEADER_ROW),)),                 # load_data
+    (URL_ANIVERSARIOS, (("TRIPULAÇÃO", 6),)),                    # load_tripulacao
+    (URL_DIAS_MAR, ((None, 7),)),                                # load_dias_mar
+    (URL_AUSENCIAS, (("Metas", None), ("Datas_importantes", None))),  # load_metas / load_datas_importantes
+    (URL_TABELA_SERVICO, tuple((f"TABELA {i}", None) for i in (1, 2, 3))),  # load_tabela_servico_dia
+    (URL_ADESTRAMENTO, ABAS_ADESTRAMENTO),                       # load_adestramento
+    (URL_CARDAPIO, ((None, None),)),                             # load_cardapio
+    (URL_LOTACAO, ((None, None),)),                              # load_lotacao_data
+)
+
+@st.cache_resource
+def get_prefetch_pool():
+    """Pool de threads pequeno e fixo, compartilhado por todas as sessões do processo."""
+    return ThreadPoolExecutor(max_workers=3, thread_name_prefix="prefetch")
+
+def prefetch_planilhas():
+    """
+    Dispara o download de todos os grupos de abas em paralelo, uma vez por sessão.
+    Cada grupo entra na fila no máximo uma vez por vez no processo inteiro (o mesmo
+    conjunto "em_andamento" das revalidações), então várias sessões logando juntas
+    não empilham downloads repetidos.
+    """
+    if st.session_state.get("prefetch_disparado"):
+        return
+    st.session_state["prefetch_disparado"] = True
+    try:
+        cliente_sheets = get_sheets_service()
+        cliente_drive = get_drive_service()
+    except Exception as e:
+        print(f"Pré-carregamento indisponível: {e}")
+        return
+    estado = get_snapshot_state()
+    pool = get_prefetch_pool()
+    for spreadsheet, abas in PREFETCH_GRUPOS:
+        chaves = [_chave_snapshot(spreadsheet, ws, header) for ws, header in abas]
+        chave_grupo = "|".join(chaves)
+        with estado["lock"]:
+            if chave_grupo in estado["em_andamento"]:
+                continue
+            estado["em_andamento"].add(chave_grupo)
+        pool.submit(_revalidar_grupo, chave_grupo, spreadsheet, abas, chaves, estado, cliente_sheets, cliente_drive)
+
+prefetch_planilhas()
 
 
 # ============================================================
@@ -1407,221 +2289,746 @@ def descobrir_blocos_datas(df: pd.DataFrame):
         blocos.append((col_ini, col_fim, col_mot, tipo_base))
     return blocos
 
-BLOCOS_DATAS = descobrir_blocos_datas(df_raw)
+
+@st.cache_data(ttl=600)
+def datas_dos_blocos(_df_raw: pd.DataFrame, blocos, versao: str):
+    """Colunas de Início/Fim de cada bloco já convertidas em lote, pelo mesmo índice de df_raw (cache por versão)."""
+    return {
+        col: parse_sheet_dates(_df_raw[col])
+        for col_ini, col_fim, _, _ in blocos
+        for col in (col_ini, col_fim)
+        if col in _df_raw.columns
+    }
 
 # ============================================================
 # 5. TRANSFORMAÇÃO EM EVENTOS (WIDE → LONG)
 # ============================================================
 
-@st.cache_data(ttl=600)
-def construir_eventos(df_raw: pd.DataFrame, blocos) -> pd.DataFrame:
-    eventos = []
-    for _, row in df_raw.iterrows():
-        posto  = row.get("Posto", "")
-        nome   = row.get("Nome", "")
-        escala = row.get("Serviço", "")
-        
-        eqman_val = row.get("EqMan", "")
-        eqman = str(eqman_val) if pd.notna(eqman_val) and str(eqman_val) != "-" else "Não"
-        
-        gvi = parse_bool(row.get("Gvi/GP", ""))
-        insp = parse_bool(row.get("IN", ""))
-
-        # Lógica para encontrar a coluna grupos de forma robusta
-        cols_lower = [str(c).lower().strip() for c in row.index]
-        grupos_val = []
-        
-        # Lógica para encontrar a coluna grupos de forma robusta
-        # USER REQUEST: Coluna 66 (index 65, 0-based)
-        grupos_val = []
-        
-        try:
-            # Tenta encontrar coluna que contém 'conflito' ou 'grupo'
-            found_col = None
-            for c in row.index:
-                c_str = str(c).lower()
-                if "conflito" in c_str or "grupo" in c_str:
-                    found_col = c
-                    break
-            
-            if found_col:
-                grupos_val = row[found_col]
-            else:
-                # Fallback para o index 65 (Coluna 66 - JM segundo usuario, mas index numerico)
-                grupos_val = row.iloc[65]
-        except:
-             grupos_val = []
-
-        militar_info = {
-            "Posto": posto,
-            "Nome": nome,
-            "Divisão": str(row.get("Divisão", "")).strip(),
-            "Escala": escala,
-            "EqMan": eqman,
-            "GVI": gvi,
-            "IN": insp,
-            "Grupos": parse_grupos(grupos_val), 
-        }
-
-        for col_ini, col_fim, col_mot, tipo_base in blocos:
-            ini = parse_sheet_date(row.get(col_ini))
-            fim = parse_sheet_date(row.get(col_fim))
-
-            if pd.isna(ini) or pd.isna(fim):
-                continue
-            
-            if fim < ini:
-                ini, fim = fim, ini
-                
-            dur = (fim - ini).days + 1
-            if dur < 1 or dur > 365 * 2:
-                continue
+def _coluna_ou_padrao(df, nome, padrao=""):
+    """Coluna do DataFrame, ou uma coluna constante quando ela não existir (como row.get)."""
+    if nome is not None and nome in df.columns:
+        return df[nome]
+    return pd.Series([padrao] * len(df), index=df.index, dtype=object)
+
+def _coluna_grupos(df):
+    """Coluna de grupos: a primeira com 'conflito' ou 'grupo' no nome; senão a coluna 66 (index 65)."""
+    for c in df.columns:
+        c_str = str(c).lower()
+        if "conflito" in c_str or "grupo" in c_str:
+            return df[c]
+    # USER REQUEST: Coluna 66 (index 65, 0-based)
+    if df.shape[1] > 65:
+        return df.iloc[:, 65]
+    return pd.Series([[]] * len(df), index=df.index, dtype=object)
+
+def construir_eventos(df_raw: pd.DataFrame, blocos, linhas: bool = False):
+    """
+    Converte a planilha larga (um bloco Início/Fim/Motivo por afastamento) em um
+    evento por linha. Tudo por coluna: cada bloco vira um pedaço do formato longo,
+    as datas são convertidas por coluna e as regras (inversão, duração, tipo) são máscaras.
+    Com linhas=True devolve também a posição (iloc) em df_raw de onde saiu cada evento.
+    """
+    sem_eventos = (pd.DataFrame(), np.array([], dtype="int64")) if linhas else pd.DataFrame()
+    if df_raw.empty or not blocos:
+        return sem_eventos
+
+    # --- Dados do militar (um por linha da planilha) ---
+    # astype(object): as colunas category de df_raw voltam a texto antes de ganhar valores novos
+    eqman_val = _coluna_ou_padrao(df_raw, "EqMan").astype(object)
+    eqman_str = eqman_val.map(str)
+    militares = {
+        "Posto": _coluna_ou_padrao(df_raw, "Posto"),
+        "Nome": _coluna_ou_padrao(df_raw, "Nome"),
+        "Divisão": _coluna_ou_padrao(df_raw, "Divisão").astype(object).map(str).str.strip(),
+        # Chave de comparação da divisão (maiúsculas), calculada uma vez na montagem
+        "divisao_key": _coluna_ou_padrao(df_raw, "Divisão").astype(object).map(str).str.strip().str.upper(),
+        "Escala": _coluna_ou_padrao(df_raw, "Serviço"),
+        "EqMan": eqman_str.where(eqman_val.notna() & (eqman_str != "-"), "Não"),
+        "GVI": pd.Series(parse_bools(_coluna_ou_padrao(df_raw, "Gvi/GP")), index=df_raw.index),
+        "IN": pd.Series(parse_bools(_coluna_ou_padrao(df_raw, "IN")), index=df_raw.index),
+        "Grupos": _coluna_grupos(df_raw).map(parse_grupos),
+    }
 
-            if tipo_base == "Férias":
-                motivo_real = "Férias"
-                tipo_final = "Férias"
-            else:
-                motivo_texto = str(row.get(col_mot, "")).strip()
-                if tipo_base == "Curso":
-                    motivo_real = motivo_texto if motivo_texto and "nan" not in motivo_texto.lower() else "CURSO (não especificado)"
-                    tipo_final = "Curso"
-                else:
-                    motivo_real = motivo_texto if motivo_texto and "nan" not in motivo_texto.lower() else "OUTROS"
-                    tipo_final = "Outros"
+    # --- Blocos de datas (wide -> long) ---
+    partes = []
+    for n_bloco, (col_ini, col_fim, col_mot, tipo_base) in enumerate(blocos):
+        ini = parse_sheet_dates(_coluna_ou_padrao(df_raw, col_ini, None))
+        fim = parse_sheet_dates(_coluna_ou_padrao(df_raw, col_fim, None))
+        ok = (ini.notna() & fim.notna()).to_numpy()
+        if not ok.any():
+            continue
 
-            if tipo_final == "Férias":
-                motivo_agr = "Férias"
-            elif tipo_final == "Curso":
-                motivo_agr = "Curso"
+        if tipo_base == "Férias":
+            motivo = pd.Series("Férias", index=df_raw.index)
+            motivo_agr = motivo
+        else:
+            texto = _coluna_ou_padrao(df_raw, col_mot).map(lambda v: str(v).strip())
+            texto_ok = (texto != "") & ~texto.str.lower().str.contains("nan", regex=False)
+            if tipo_base == "Curso":
+                motivo = texto.where(texto_ok, "CURSO (não especificado)")
+                motivo_agr = pd.Series("Curso", index=df_raw.index)
             else:
-                motivo_agr = motivo_real
-
-            eventos.append({
-                **militar_info,
-                "Inicio": ini,
-                "Fim": fim,
-                "Duracao_dias": dur,
-                "Motivo": motivo_real,
-                "MotivoAgrupado": motivo_agr,
-                "Tipo": tipo_final
-            })
-    return pd.DataFrame(eventos)
-
-df_eventos = construir_eventos(df_raw, BLOCOS_DATAS)
+                motivo = texto.where(texto_ok, "OUTROS")
+                motivo_agr = motivo
+        tipo_final = tipo_base if tipo_base in ("Férias", "Curso") else "Outros"
+
+        partes.append(pd.DataFrame({
+            "pos": np.flatnonzero(ok),
+            "bloco": n_bloco,
+            "Inicio": ini.to_numpy()[ok],
+            "Fim": fim.to_numpy()[ok],
+            "Motivo": motivo.to_numpy()[ok],
+            "MotivoAgrupado": motivo_agr.to_numpy()[ok],
+            "Tipo": tipo_final,
+        }))
+
+    if not partes:
+        return sem_eventos
+    longo = pd.concat(partes, ignore_index=True)
+
+    # Datas invertidas são trocadas; só vale duração entre 1 dia e 2 anos
+    troca = longo["Fim"] < longo["Inicio"]
+    ini_ok = longo["Inicio"].where(~troca, longo["Fim"])
+    fim_ok = longo["Fim"].where(~troca, longo["Inicio"])
+    longo["Inicio"], longo["Fim"] = ini_ok, fim_ok
+    longo["Duracao_dias"] = (longo["Fim"] - longo["Inicio"]).dt.days + 1
+    longo = longo[(longo["Duracao_dias"] >= 1) & (longo["Duracao_dias"] <= 365 * 2)]
+    if longo.empty:
+        return sem_eventos
+
+    # Mesma ordem do laço original: linha da planilha, depois bloco
+    longo = longo.sort_values(["pos", "bloco"], kind="mergesort")
+    pos = longo["pos"].to_numpy()
+    # Colunas montadas a partir de valores (object), para o pandas inferir os tipos
+    # só das linhas que viraram evento, como no DataFrame de dicionários de antes
+    eventos = {col: serie.to_numpy(dtype=object)[pos].tolist() for col, serie in militares.items()}
+    for col in ["Inicio", "Fim", "Duracao_dias", "Motivo", "MotivoAgrupado", "Tipo"]:
+        eventos[col] = longo[col].tolist()
+    df_eventos = normalizar_tipos(pd.DataFrame(eventos), bools=("GVI", "IN"))
+    return (df_eventos, pos) if linhas else df_eventos
 
 # ============================================================
 # 6. LÓGICA DE CONFLITOS (NOVO)
 # ============================================================
-def detectar_conflitos(df_eventos):
+@st.cache_data(ttl=600)
+def detectar_conflitos(_df_eventos, versao: str):
     """
     Detecta conflitos de férias entre militares do mesmo grupo.
-    Retorna um DataFrame com os conflitos.
+    Retorna um DataFrame com os conflitos (cache pela versão de df_raw).
+
+    Varredura por grupo: eventos em ordem de início e um heap dos ainda em curso
+    (por Fim). Quem terminou antes do início atual sai do heap; os que sobram
+    sobrepõem o evento atual, então só pares que conflitam de fato são visitados.
     """
-    if df_eventos.empty:
+    if _df_eventos.empty:
         return pd.DataFrame()
 
     # Considera TODOS os eventos de ausência (Férias, Cursos, Licenças, etc.)
-    df_ausencias = df_eventos.copy()
+    df_ausencias = _df_eventos.copy()
     
     conflict_data = []
 
     # Explode por grupo para comparar dentro de cada grupo
     # Cada linha será (Pessoa, Grupo, DataIni, DataFim)
     df_exploded = df_ausencias.explode("Grupos")
-    df_exploded = df_exploded.dropna(subset=["Grupos"])
+    df_exploded = df_exploded.dropna(subset=["Grupos", "Inicio", "Fim"])
     
     # Remove strings vazias que possam ter sobrado
     df_exploded = df_exploded[df_exploded["Grupos"] != ""]
     
     # Agrupa por Grupo
     for grupo, group_df in df_exploded.groupby("Grupos"):
-        # Itera pares para achar overlap
-        # Otimização: ordenar por data início
-        group_df = group_df.sort_values("Inicio")
+        group_df = group_df.sort_values("Inicio", kind="mergesort")
         records = group_df.to_dict("records")
         
-        for i in range(len(records)):
-            for j in range(i + 1, len(records)):
-                p1 = records[i]
-                p2 = records[j]
-                
+        pares = []
+        ativos = []  # heap de (Fim, i)
+        for j, p2 in enumerate(records):
+            while ativos and ativos[0][0] < p2["Inicio"]:
+                heapq.heappop(ativos)
+            for _, i in ativos:
                 # Se nomes são iguais, não é conflito
-                if p1["Nome"] == p2["Nome"]:
-                    continue
-                    
-                # Overlap Check
-                if (p1["Inicio"] <= p2["Fim"]) and (p2["Inicio"] <= p1["Fim"]):
-                    # Calcula dias de sobreposição
-                    start_overlap = max(p1["Inicio"], p2["Inicio"])
-                    end_overlap = min(p1["Fim"], p2["Fim"])
-                    days_overlap = (end_overlap - start_overlap).days + 1
-                    
-                    periodo_conflito = f"{start_overlap.strftime('%d/%m')} - {end_overlap.strftime('%d/%m')}"
-                    # Inclui o motivo da ausência ao lado do nome
-                    motivo_1 = p1.get("MotivoAgrupado", "Ausente")
-                    motivo_2 = p2.get("MotivoAgrupado", "Ausente")
-                    
-                    conflict_data.append({
-                        "Grupo": grupo,
-                        "Militar 1": f"{p1['Posto']} {p1['Nome']} ({motivo_1})",
-                        "Militar 2": f"{p2['Posto']} {p2['Nome']} ({motivo_2})",
-                        "Período Conflito": periodo_conflito,
-                        "Dias Conflito": days_overlap
-                    })
+                if records[i]["Nome"] != p2["Nome"]:
+                    pares.append((i, j))
+            heapq.heappush(ativos, (p2["Fim"], j))
+        # Mesma ordem da comparação par a par (i, depois j)
+        pares.sort()
+        
+        for i, j in pares:
+            p1 = records[i]
+            p2 = records[j]
+            # Calcula dias de sobreposição
+            start_overlap = max(p1["Inicio"], p2["Inicio"])
+            end_overlap = min(p1["Fim"], p2["Fim"])
+            days_overlap = (end_overlap - start_overlap).days + 1
+            
+            periodo_conflito = f"{start_overlap.strftime('%d/%m')} - {end_overlap.strftime('%d/%m')}"
+            # Inclui o motivo da ausência ao lado do nome
+            motivo_1 = p1.get("MotivoAgrupado", "Ausente")
+            motivo_2 = p2.get("MotivoAgrupado", "Ausente")
+            
+            conflict_data.append({
+                "Grupo": grupo,
+                "Militar 1": f"{p1['Posto']} {p1['Nome']} ({motivo_1})",
+                "Militar 2": f"{p2['Posto']} {p2['Nome']} ({motivo_2})",
+                "Período Conflito": periodo_conflito,
+                "Dias Conflito": days_overlap
+            })
 
     return pd.DataFrame(conflict_data)
 
 
 # ============================================================
-# 6. EXPANSÃO POR DIA
+# 6. AUSÊNCIAS POR INTERVALO (SEM EXPANDIR DIA A DIA)
 # ============================================================
+# Os gráficos trabalham direto sobre os intervalos [Inicio, Fim] de df_eventos:
+# contagens diárias saem de um vetor de diferenças e as mensais de uma expansão
+# evento × mês. Nada é materializado por militar × dia.
+# "Quem está fora no dia D / no período [A, B]" usa um índice de intervalos montado
+# uma vez por versão dos dados (o INDICE_EVENTOS das páginas): vetor de inícios
+# ordenado + árvore de intervalos centrada, consulta em O(log n + k).
+
+def _montar_arvore(inicio, fim) -> dict:
+    """
+    Árvore de intervalos centrada sobre os intervalos [inicio[i], fim[i]] (int64 ns).
+    Cada nó guarda o centro (mediana dos extremos do seu conjunto), os intervalos que
+    o contêm, em duas ordens (início crescente e fim decrescente), e os filhos com os
+    intervalos inteiramente à esquerda/direita. Cada filho fica com no máximo metade
+    dos intervalos do pai: profundidade O(log n).
+    """
+    arvore = {"centro": [], "esq": [], "dir": [], "ini": [], "pos_ini": [], "neg_fim": [], "pos_fim": []}
+
+    def montar(idx):
+        if len(idx) == 0:
+            return -1
+        extremos = np.concatenate([inicio[idx], fim[idx]])
+        meio = len(extremos) // 2
+        centro = np.partition(extremos, meio)[meio]
+        esq = fim[idx] < centro
+        dir_ = inicio[idx] > centro
+        aqui = idx[~(esq | dir_)]
+        por_ini = aqui[np.argsort(inicio[aqui], kind="mergesort")]
+        por_fim = aqui[np.argsort(-fim[aqui], kind="mergesort")]
+        no = len(arvore["centro"])
+        for campo, valor in (("centro", centro), ("esq", -1), ("dir", -1), ("ini", inicio[por_ini]),
+                             ("pos_ini", por_ini), ("neg_fim", -fim[por_fim]), ("pos_fim", por_fim)):
+            arvore[campo].append(valor)
+        arvore["esq"][no] = montar(idx[esq])
+        arvore["dir"][no] = montar(idx[dir_])
+        return no
+
+    arvore["raiz"] = montar(np.arange(len(inicio)))
+    return arvore
+
+def _contendo(arvore, ponto) -> np.ndarray:
+    """Posições (no vetor ordenado) dos intervalos com inicio <= ponto <= fim: O(log n + k)."""
+    achados = []
+    no = arvore["raiz"]
+    while no != -1:
+        centro = arvore["centro"][no]
+        if ponto < centro:
+            # Todos os intervalos do nó terminam depois de ponto: basta inicio <= ponto
+            k = np.searchsorted(arvore["ini"][no], ponto, side="right")
+            achados.append(arvore["pos_ini"][no][:k])
+            no = arvore["esq"][no]
+        elif ponto > centro:
+            # Todos começam antes de ponto: basta fim >= ponto
+            k = np.searchsorted(arvore["neg_fim"][no], -ponto, side="right")
+            achados.append(arvore["pos_fim"][no][:k])
+            no = arvore["dir"][no]
+        else:
+            achados.append(arvore["pos_ini"][no])
+            break
+    return np.concatenate(achados) if achados else np.array([], dtype="int64")
+
+def _completar_indice(ordem, inicio, fim) -> dict:
+    """Índice a partir dos vetores já ordenados por início (datetime64[ns])."""
+    return {
+        "ordem": ordem,
+        "inicio": inicio,
+        "fim": fim,
+        "arvore": _montar_arvore(inicio.view("int64"), fim.view("int64")),
+    }
+
+def _montar_indice(df_ev) -> dict:
+    """
+    Índice de intervalos de df_ev: posições (iloc) ordenadas por Inicio, com Inicio
+    e Fim nessa ordem (datetime64[ns]), e a árvore de intervalos sobre eles.
+    Eventos sem Inicio/Fim ficam de fora (nunca casam com datas).
+    """
+    if df_ev.empty:
+        vazio = np.array([], dtype="datetime64[ns]")
+        return _completar_indice(np.array([], dtype="int64"), vazio, vazio)
+    inicio = df_ev["Inicio"].to_numpy(dtype="datetime64[ns]")
+    fim = df_ev["Fim"].to_numpy(dtype="datetime64[ns]")
+    validos = np.flatnonzero(~(np.isnat(inicio) | np.isnat(fim)))
+    ordem = validos[np.argsort(inicio[validos], kind="mergesort")]
+    return _completar_indice(ordem, inicio[ordem], fim[ordem])
+
+def eventos_no_periodo(df_ev, ini, fim, indice=None) -> pd.DataFrame:
+    """
+    Eventos de df_ev que tocam [ini, fim] (Inicio <= fim e Fim >= ini), na ordem
+    original. São os que contêm ini (árvore de intervalos) mais os que começam em
+    (ini, fim] (busca binária nos inícios): O(log n + k), independente do histórico.
+    `indice` é o índice de df_ev (INDICE_EVENTOS para df_eventos); sem ele, o índice
+    é montado na hora, O(n log n).
+    """
+    if df_ev.empty:
+        return df_ev
+    if indice is None:
+        indice = _montar_indice(df_ev)
+    a = np.datetime64(pd.Timestamp(ini), "ns").astype("int64")
+    b = np.datetime64(pd.Timestamp(fim), "ns").astype("int64")
+    if b < a:
+        return df_ev.iloc[:0]
+    lo = np.searchsorted(indice["inicio"].view("int64"), a, side="right")
+    hi = np.searchsorted(indice["inicio"].view("int64"), b, side="right")
+    pos = np.concatenate([_contendo(indice["arvore"], a), np.arange(lo, hi)])
+    return df_ev.iloc[np.sort(indice["ordem"][pos])]
+
+def ausentes_em(df_ev, data, indice=None) -> pd.DataFrame:
+    """Eventos em curso na data (Inicio <= data <= Fim)."""
+    return eventos_no_periodo(df_ev, data, data, indice)
+
+def _intervalos_por_militar(df_ev, ini=None, fim=None):
+    """
+    Intervalos de ausência recortados a [ini, fim] e fundidos por militar (Nome),
+    para que eventos sobrepostos da mesma pessoa não contem em dobro no mesmo dia.
+    """
+    d = df_ev[["Nome", "Inicio", "Fim"]].dropna().copy()
+    d["Inicio"] = d["Inicio"].dt.normalize()
+    d["Fim"] = d["Fim"].dt.normalize()
+    if ini is not None:
+        d["Inicio"] = d["Inicio"].clip(lower=pd.Timestamp(ini))
+    if fim is not None:
+        d["Fim"] = d["Fim"].clip(upper=pd.Timestamp(fim))
+    d = d[d["Inicio"] <= d["Fim"]]
+    if d.empty:
+        return d
+    d = d.sort_values(["Nome", "Inicio"], kind="mergesort")
+    fim_anterior = d.groupby("Nome", sort=False, observed=True)["Fim"].cummax().groupby(d["Nome"], sort=False, observed=True).shift()
+    novo_bloco = fim_anterior.isna() | (d["Inicio"] > fim_anterior + pd.Timedelta(days=1))
+    return d.groupby(novo_bloco.cumsum()).agg(Nome=("Nome", "first"), Inicio=("Inicio", "min"), Fim=("Fim", "max"))
+
+def ausentes_por_dia(df_ev, ini=None, fim=None) -> pd.Series:
+    """Militares distintos ausentes em cada dia (só dias com alguém ausente), via vetor de diferenças."""
+    if df_ev.empty:
+        return pd.Series(dtype="int64")
+    blocos = _intervalos_por_militar(df_ev, ini, fim)
+    if blocos.empty:
+        return pd.Series(dtype="int64")
+    base = blocos["Inicio"].min()
+    dias = pd.date_range(base, blocos["Fim"].max(), freq="D")
+    delta = np.zeros(len(dias) + 1, dtype="int64")
+    np.add.at(delta, (blocos["Inicio"] - base).dt.days.to_numpy(), 1)
+    np.add.at(delta, (blocos["Fim"] - base).dt.days.to_numpy() + 1, -1)
+    contagem = pd.Series(np.cumsum(delta)[:-1], index=dias)
+    return contagem[contagem > 0]
+
+def eventos_por_mes(df_ev) -> pd.DataFrame:
+    """
+    Uma linha por evento × mês que ele toca (np.repeat), com Mes (1º dia do mês)
+    e DiasNoMes (dias do evento dentro daquele mês).
+    """
+    d = df_ev.dropna(subset=["Inicio", "Fim"])
+    if d.empty:
+        return d.assign(Mes=pd.Series(dtype="datetime64[us]"), DiasNoMes=pd.Series(dtype="int64"))
+    ini = d["Inicio"].dt.normalize()
+    fim = d["Fim"].dt.normalize()
+    mes_ini = ini.dt.year * 12 + ini.dt.month - 1
+    n_meses = (fim.dt.year * 12 + fim.dt.month - 1 - mes_ini + 1).to_numpy()
+    rep = np.repeat(np.arange(len(d)), n_meses)
+    deslocamento = np.arange(len(rep)) - np.repeat(np.cumsum(n_meses) - n_meses, n_meses)
+    mes_abs = mes_ini.to_numpy()[rep] + deslocamento
+    out = d.iloc[rep].reset_index(drop=True)
+    out["Mes"] = pd.to_datetime(pd.DataFrame({"year": mes_abs // 12, "month": mes_abs % 12 + 1, "day": 1}))
+    fim_mes = out["Mes"] + pd.offsets.MonthEnd(0)
+    ini_clip = np.maximum(ini.to_numpy()[rep], out["Mes"].to_numpy())
+    fim_clip = np.minimum(fim.to_numpy()[rep], fim_mes.to_numpy())
+    out["DiasNoMes"] = ((fim_clip - ini_clip) // np.timedelta64(1, "D")).astype("int64") + 1
+    return out
+
+def militares_por_mes(em, por=None) -> pd.DataFrame:
+    """
+    Militares distintos com ao menos um dia de ausência em cada mês (colunas Mes[, por],
+    Militares), a partir de linhas por mês: uma fatia do cubo ou eventos_por_mes.
+    """
+    chaves = ["Mes"] + ([por] if por else [])
+    if em.empty:
+        return pd.DataFrame(columns=chaves + ["Militares"])
+    return em.groupby(chaves, observed=True)["Nome"].nunique().reset_index(name="Militares")
+
+# --- Cubo mensal ---
+# Todos os gráficos mensais (Ausentes, Estatísticas, Férias) fatiam o mesmo cubo,
+# montado uma vez por versão dos dados. Como contagens de militares distintos não
+# se somam entre fatias, o cubo guarda o militar (Nome) como dimensão.
+DIMENSOES_CUBO = ["Mes", "Nome", "Divisão", "divisao_key", "MotivoAgrupado", "Tipo", "Escala", "EqMan", "IN", "GVI"]
 
 @st.cache_data(ttl=600)
-def expandir_eventos_por_dia(df_eventos: pd.DataFrame) -> pd.DataFrame:
-    if df_eventos.empty:
-        return pd.DataFrame()
-    linhas = []
-    for _, ev in df_eventos.iterrows():
-        ini = ev["Inicio"]
-        fim = ev["Fim"]
-        if pd.isna(ini) or pd.isna(fim):
-            continue
-        for data in pd.date_range(ini, fim):
-            linhas.append({
-                "Data": data,
-                "Posto": ev["Posto"],
-                "Nome": ev["Nome"],
-                "Divisão": ev["Divisão"],
-                "Escala": ev["Escala"],
-                "EqMan": ev["EqMan"],
-                "GVI": ev["GVI"],
-                "IN": ev["IN"],
-                "Motivo": ev["Motivo"],
-                "MotivoAgrupado": ev["MotivoAgrupado"],
-                "Tipo": ev["Tipo"]
-            })
-    return pd.DataFrame(linhas)
+def cubo_ausencias(_df_eventos, versao: str) -> dict:
+    """
+    "mes": uma linha por mês × militar × Divisão × MotivoAgrupado × Tipo × Escala ×
+    EqMan/IN/GVI, com DiasNoMes (dias-militar; eventos sobrepostos somam). Leva junto
+    a divisao_key dos eventos, para fatia_cubo comparar sem normalizar texto.
+    "media_dia": média de militares ausentes por dia (dias com alguém ausente) em cada mês.
+    """
+    vazio = {
+        "mes": pd.DataFrame(columns=DIMENSOES_CUBO + ["DiasNoMes"]),
+        "media_dia": pd.DataFrame(columns=["Mes", "Media_ausentes_dia"]),
+    }
+    if _df_eventos.empty:
+        return vazio
+    em = eventos_por_mes(_df_eventos)
+    if em.empty:
+        return vazio
+    mes = em.groupby(DIMENSOES_CUBO, observed=True, dropna=False, sort=False)["DiasNoMes"].sum().reset_index()
+    diario = ausentes_por_dia(_df_eventos)
+    media_dia = diario.groupby(diario.index.to_period("M").to_timestamp()).mean()
+    return {"mes": mes, "media_dia": media_dia.rename_axis("Mes").reset_index(name="Media_ausentes_dia")}
+
+def fatia_cubo(cubo_mes, apenas_eqman=False, apenas_in=False, apenas_gvi=False, divisao="Todos", tipo=None) -> pd.DataFrame:
+    """Linhas do cubo com os mesmos filtros de filtrar_eventos (e, se dado, só um Tipo)."""
+    mascara = np.ones(len(cubo_mes), dtype=bool)
+    if divisao != "Todos":
+        mascara &= (cubo_mes["divisao_key"] == divisao.strip().upper()).to_numpy()
+    if apenas_eqman:
+        mascara &= (cubo_mes["EqMan"] != "Não").to_numpy()
+    if apenas_in:
+        mascara &= (cubo_mes["IN"] == True).to_numpy()
+    if apenas_gvi:
+        mascara &= (cubo_mes["GVI"] == True).to_numpy()
+    if tipo is not None:
+        mascara &= (cubo_mes["Tipo"] == tipo).to_numpy()
+    return cubo_mes[mascara]
+
+# ============================================================
+# 6.1 RECONSTRUÇÃO INCREMENTAL DOS EVENTOS
+# ============================================================
+# Cada linha de df_raw tem um hash, guardado por chave (NIP, ou Nome). Quando a
+# planilha atualiza, só as linhas incluídas, alteradas ou removidas passam pela
+# construção de eventos (parse de datas, regras de tipo/motivo), que é a parte cara.
+# O resto continua proporcional ao total, não às edições: df_eventos é reconcatenado
+# e renormalizado, as chaves são reordenadas e a árvore de intervalos é remontada
+# (O(n log n), só com operações vetoriais e sem parse). Mudança de colunas ou de
+# blocos de datas refaz tudo.
+
+@st.cache_resource
+def get_eventos_store():
+    """Eventos da versão atual de df_raw, compartilhados entre sessões (Streamlit reexecuta o script a cada clique)."""
+    return {
+        "lock": threading.Lock(),
+        "versao": None,       # versao_dados(df_raw) já aplicada
+        "assinatura": None,   # (colunas, blocos) da última montagem
+        "hashes": {},         # chave -> hash da linha
+        "ordem": [],          # chaves na ordem de df_raw
+        "eventos": None,
+        "chaves": None,       # chave de cada linha de "eventos"
+        "indice": None,
+        "mudancas": [],
+        "atualizado_em": None,
+    }
+
+def _chaves_linhas(df_raw) -> list:
+    """Chave estável de cada linha: NIP (ou Nome), com #n para repetições."""
+    col = "NIP" if "NIP" in df_raw.columns else "Nome"
+    if col not in df_raw.columns:
+        return [f"#{i}" for i in range(len(df_raw))]
+    base = df_raw[col].astype(object).map(lambda v: str(v).strip())
+    ocorrencia = base.groupby(base, sort=False).cumcount()
+    return [f"{b}#{o}" if o else b for b, o in zip(base, ocorrencia)]
+
+def _sem_categorias(df):
+    """Volta colunas category a object, para concatenar pedaços e recategorizar o todo."""
+    cats = {c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}
+    return df.astype(cats) if cats else df
+
+def _remendar_indice(indice, manter, nova_pos, inicio_novos, fim_novos, pos_novos) -> dict:
+    """
+    Índice após tirar os eventos com manter=False e incluir os novos: os que ficam
+    só trocam de posição (nova_pos, pela posição antiga) e os novos entram nos
+    lugares certos do vetor de inícios por busca binária, sem reordenar tudo.
+    A árvore de intervalos é remontada inteira sobre o resultado (O(n log n)).
+    """
+    fica = manter[indice["ordem"]]
+    ordem = nova_pos[indice["ordem"][fica]]
+    inicio = indice["inicio"][fica]
+    fim = indice["fim"][fica]
+    validos = ~(np.isnat(inicio_novos) | np.isnat(fim_novos))
+    inicio_novos, fim_novos, pos_novos = inicio_novos[validos], fim_novos[validos], pos_novos[validos]
+    ordem_novos = np.argsort(inicio_novos, kind="mergesort")
+    inicio_novos, fim_novos, pos_novos = inicio_novos[ordem_novos], fim_novos[ordem_novos], pos_novos[ordem_novos]
+    onde = np.searchsorted(inicio, inicio_novos, side="right")
+    # A árvore é refeita sobre os vetores remendados (já ordenados: sem argsort do todo)
+    return _completar_indice(
+        np.insert(ordem, onde, pos_novos),
+        np.insert(inicio, onde, inicio_novos),
+        np.insert(fim, onde, fim_novos),
+    )
 
-df_dias = expandir_eventos_por_dia(df_eventos)
+def _montar_tudo(store, df_raw, blocos, chaves, assinatura):
+    eventos, linhas = construir_eventos(df_raw, blocos, linhas=True)
+    store["eventos"] = eventos
+    store["chaves"] = np.asarray(chaves, dtype=object)[linhas]
+    store["indice"] = _montar_indice(eventos)
+    store["assinatura"] = assinatura
+
+def _remendar_eventos(store, df_raw, blocos, chaves, refazer, sair):
+    """
+    Refaz só os eventos das chaves em `refazer` e tira os das chaves em `sair`.
+    A construção é incremental; a junção com os mantidos percorre o quadro inteiro.
+    """
+    antigos = store["eventos"]
+    manter = ~np.isin(store["chaves"], list(sair | refazer)) if len(antigos) else np.zeros(0, dtype=bool)
+    pos_refazer = [i for i, c in enumerate(chaves) if c in refazer]
+    novos, linhas = construir_eventos(df_raw.iloc[pos_refazer], blocos, linhas=True)
+    chaves_novos = np.asarray(chaves, dtype=object)[pos_refazer][linhas] if len(linhas) else np.array([], dtype=object)
+
+    # Eventos em ordem de df_raw (e de bloco, dentro da linha): ordenação estável pela posição da chave
+    chaves_ev = np.concatenate([store["chaves"][manter] if len(antigos) else np.array([], dtype=object), chaves_novos])
+    posicao = {c: i for i, c in enumerate(chaves)}
+    ordem = np.argsort(np.array([posicao[c] for c in chaves_ev], dtype="int64"), kind="stable")
+    pedacos = [_sem_categorias(p) for p in (antigos[manter] if len(antigos) else antigos, novos) if len(p)]
+    if pedacos:
+        juntos = pd.concat(pedacos, ignore_index=True).iloc[ordem].reset_index(drop=True)
+        # infer_objects: colunas de texto voltam ao tipo que a montagem completa inferiria
+        eventos = normalizar_tipos(juntos.infer_objects())
+    else:
+        eventos = pd.DataFrame()
+
+    # Posição final de cada linha de `juntos` (mantidos primeiro, depois novos)
+    nova_pos = np.empty(len(ordem), dtype="int64")
+    nova_pos[ordem] = np.arange(len(ordem))
+    n_mantidos = int(manter.sum())
+    pos_mantidos = np.full(len(antigos), -1, dtype="int64")
+    pos_mantidos[manter] = nova_pos[:n_mantidos]
+    if len(novos):
+        ini_novos = novos["Inicio"].to_numpy(dtype="datetime64[ns]")
+        fim_novos = novos["Fim"].to_numpy(dtype="datetime64[ns]")
+    else:
+        ini_novos = fim_novos = np.array([], dtype="datetime64[ns]")
+    store["indice"] = _remendar_indice(store["indice"], manter, pos_mantidos, ini_novos, fim_novos, nova_pos[n_mantidos:])
+    store["eventos"] = eventos
+    store["chaves"] = chaves_ev[ordem]
+
+def eventos_incrementais(df_raw, blocos):
+    """
+    (df_eventos, índice de intervalos) da versão atual de df_raw, refazendo só as
+    linhas que mudaram desde a última chamada. Registra a lista de mudanças.
+    """
+    store = get_eventos_store()
+    versao = versao_dados(df_raw)
+    with store["lock"]:
+        # Mesma carga de df_raw (caso comum: só um clique): nada a comparar
+        if store["eventos"] is not None and store["versao"] == versao:
+            return store["eventos"].copy(deep=False), store["indice"]
+    chaves = _chaves_linhas(df_raw)
+    hashes = dict(zip(chaves, pd.util.hash_pandas_object(df_raw, index=False).tolist()))
+    assinatura = (tuple(map(str, df_raw.columns)), tuple(blocos))
+    with store["lock"]:
+        anteriores = store["hashes"]
+        if store["eventos"] is None or store["assinatura"] != assinatura:
+            _montar_tudo(store, df_raw, blocos, chaves, assinatura)
+            mudancas = [] if store["atualizado_em"] is None else [{"Chave": "(todas)", "Mudança": "Recarga completa"}]
+        else:
+            incluidos = [c for c in chaves if c not in anteriores]
+            alterados = [c for c in chaves if c in anteriores and anteriores[c] != hashes[c]]
+            removidos = [c for c in anteriores if c not in hashes]
+            mudancas = (
+                [{"Chave": c, "Mudança": "Incluído"} for c in incluidos]
+                + [{"Chave": c, "Mudança": "Alterado"} for c in alterados]
+                + [{"Chave": c, "Mudança": "Removido"} for c in removidos]
+            )
+            if mudancas or store["ordem"] != chaves:
+                _remendar_eventos(store, df_raw, blocos, chaves, set(incluidos) | set(alterados), set(removidos))
+        if mudancas or store["atualizado_em"] is None:
+            store["mudancas"] = mudancas
+            store["atualizado_em"] = datetime.utcnow() - timedelta(hours=3)
+        store["hashes"] = hashes
+        store["ordem"] = chaves
+        store["versao"] = versao
+        # Cópia rasa: páginas que criam colunas não mexem no DataFrame compartilhado
+        return store["eventos"].copy(deep=False), store["indice"]
+
+def mudancas_eventos():
+    """Mudanças (chave, tipo) da última atualização de df_raw que alterou alguma linha, e quando foi."""
+    store = get_eventos_store()
+    with store["lock"]:
+        return list(store["mudancas"]), store["atualizado_em"]
 
 # ============================================================
-# 7.1 HELPER PARA STATUS EM DATA (NOVO)
+# 6.2 DADOS DE AFASTAMENTO SOB DEMANDA
 # ============================================================
+# df_raw, blocos, datas e eventos só são calculados quando a página escolhida
+# precisa deles (Cardápio, Agenda, Aniversários etc. não pagam pelo pipeline) e
+# uma única vez por execução do script. Falha na planilha principal só
+# interrompe as páginas que dependem dela.
 
-def get_status_em_data(row, data_ref, blocos_cols):
-    for col_ini, col_fim, col_mot, tipo_base in blocos_cols:
-        ini = parse_sheet_date(row.get(col_ini))
-        fim = parse_sheet_date(row.get(col_fim))
-        
-        if pd.isna(ini) or pd.isna(fim): continue
-        
-        if ini <= data_ref <= fim:
-            motivo = tipo_base
-            if col_mot and col_mot in row.index and not pd.isna(row[col_mot]):
-                motivo = str(row[col_mot])
-            return motivo
-            
-    return "Presente"
+_POR_EXECUCAO = {}  # o script é reexecutado a cada clique: vale só para esta execução
+
+def _por_execucao(nome, calcular):
+    if nome not in _POR_EXECUCAO:
+        _POR_EXECUCAO[nome] = calcular()
+    return _POR_EXECUCAO[nome]
+
+def _carregar_df_raw():
+    try:
+        return load_data()
+    except Exception as e:
+        st.error(f"Erro de conexão principal: {e}")
+        st.stop()
+
+def obter_df_raw() -> pd.DataFrame:
+    """Aba de afastamentos (load_data)."""
+    return _por_execucao("df_raw", _carregar_df_raw)
+
+def obter_versao() -> str:
+    """Impressão digital da carga atual de df_raw (versao_dados)."""
+    return _por_execucao("versao", lambda: versao_dados(obter_df_raw()))
+
+def obter_blocos() -> list:
+    """Blocos Início/Fim/Motivo detectados em df_raw."""
+    return _por_execucao("blocos", lambda: descobrir_blocos_datas(obter_df_raw()))
+
+def obter_datas_blocos() -> dict:
+    """Datas dos blocos já convertidas (datas_dos_blocos)."""
+    return _por_execucao("datas_blocos", lambda: datas_dos_blocos(obter_df_raw(), obter_blocos(), obter_versao()))
+
+def obter_eventos():
+    """(df_eventos, índice de intervalos) da carga atual."""
+    return _por_execucao("eventos", lambda: eventos_incrementais(obter_df_raw(), obter_blocos()))
+
+@st.cache_data(ttl=600)
+def series_ferias(_cubo_mes, versao: str, divisao: str, servicos: tuple) -> dict:
+    """
+    Séries dos gráficos de Férias de uma divisão ("Todos" = geral), por versão dos dados:
+    "militares_mes": militares distintos de férias por mês (Mes, Militares);
+    "por_servico": militares distintos por mês (linhas) × serviço (colunas), num pivot;
+    "dias_acumulados": dias-militar de férias acumulados de jan a dez (colunas 1..12) por ano.
+    """
+    ferias = fatia_cubo(_cubo_mes, divisao=divisao, tipo="Férias")
+    srv = ferias[ferias["Escala"].isin(servicos)]
+    if srv.empty:
+        por_servico = pd.DataFrame(columns=list(servicos), dtype="int64")
+    else:
+        por_servico = (
+            srv.pivot_table(index="Mes", columns="Escala", values="Nome", aggfunc="nunique", observed=True)
+            .reindex(columns=list(servicos)).fillna(0).astype("int64")
+        )
+    dias = (
+        ferias.pivot_table(index=ferias["Mes"].dt.year, columns=ferias["Mes"].dt.month, values="DiasNoMes", aggfunc="sum")
+        .reindex(columns=range(1, 13)).fillna(0).astype("int64").cumsum(axis=1)
+        if not ferias.empty else pd.DataFrame(columns=range(1, 13), dtype="int64")
+    )
+    return {"militares_mes": militares_por_mes(ferias), "por_servico": por_servico, "dias_acumulados": dias}
+
+@st.cache_data(ttl=600)
+def flags_tripulacao(_df_raw, versao: str) -> pd.DataFrame:
+    """
+    Marcadores de cada linha de df_raw (mesmo índice), calculados uma vez por carga:
+    is_gvi e is_in (parse_bool por valor distinto), is_eqman (EqMan preenchido e
+    diferente de "Não" e "-") e divisao_key (Divisão sem espaços, em maiúsculas).
+    """
+    def coluna(nome):
+        return _coluna_ou_padrao(_df_raw, nome, np.nan)  # ausente -> NaN -> padrão da regra
+
+    return pd.DataFrame({
+        "is_gvi": parse_bools(coluna("Gvi/GP")),
+        "is_in": parse_bools(coluna("IN")),
+        "is_eqman": por_valor_distinto(coluna("EqMan"), lambda v: str(v) not in ("Não", "-"), False, dtype=bool),
+        "divisao_key": por_valor_distinto(coluna("Divisão"), lambda v: str(v).strip().upper(), ""),
+    }, index=_df_raw.index)
+
+def obter_flags() -> pd.DataFrame:
+    """Marcadores da tripulação (flags_tripulacao) da carga atual."""
+    return _por_execucao("flags", lambda: flags_tripulacao(obter_df_raw(), obter_versao()))
+
+@st.cache_data(ttl=600)
+def particoes_divisao(_df_raw, _df_eventos, versao: str) -> dict:
+    """
+    Posições (iloc) das linhas de cada divisão normalizada (sem espaços, maiúsculas)
+    em df_raw ("tripulacao") e em df_eventos ("eventos"), uma vez por versão dos dados.
+    """
+    def por_chave(chave):
+        return pd.Series(np.arange(len(chave))).groupby(np.asarray(chave)).indices
+
+    particoes = {"tripulacao": por_chave(flags_tripulacao(_df_raw, versao)["divisao_key"]), "eventos": {}}
+    if not _df_eventos.empty and "divisao_key" in _df_eventos.columns:
+        particoes["eventos"] = por_chave(_df_eventos["divisao_key"])
+    return particoes
+
+def obter_particoes() -> dict:
+    """Partições por divisão (particoes_divisao) da carga atual."""
+    return _por_execucao("particoes", lambda: particoes_divisao(obter_df_raw(), obter_eventos()[0], obter_versao()))
+
+def da_divisao(df, divisao: str, quadro: str) -> pd.DataFrame:
+    """
+    Linhas de df da divisão, pela partição em cache. quadro: "tripulacao" (df é df_raw
+    ou recorte dele) ou "eventos" (df_eventos ou recorte dele, com o mesmo índice).
+    """
+    base = obter_df_raw() if quadro == "tripulacao" else obter_eventos()[0]
+    pos = obter_particoes()[quadro].get(divisao.strip().upper(), np.array([], dtype="int64"))
+    if df is base:
+        return df.iloc[pos]
+    return df[df.index.isin(base.index[pos])]
+
+def obter_cubo() -> dict:
+    """Cubo mensal de ausências (cubo_ausencias) da carga atual."""
+    return _por_execucao("cubo", lambda: cubo_ausencias(obter_eventos()[0], obter_versao()))
+
+# ============================================================
+# 7.1 DISPONIBILIDADE MILITAR × DIA (ESCALAS)
+# ============================================================
+
+@st.cache_data(ttl=600)
+def matriz_ausencia_ano(_datas_blocos, blocos, n_militares: int, ano: int, versao: str) -> np.ndarray:
+    """
+    Matriz booleana militar × dia do ano (linhas na ordem de df_raw): True quando
+    algum bloco de afastamento cobre o dia (Início <= dia <= Fim). Montada uma vez
+    por ano e versão com um vetor de diferenças por linha; escalas viram somas de colunas.
+    """
+    datas_blocos = _datas_blocos
+    base = np.datetime64(f"{ano}-01-01", "D")
+    n_dias = int((np.datetime64(f"{ano + 1}-01-01", "D") - base) // np.timedelta64(1, "D"))
+    delta = np.zeros((n_militares, n_dias + 1), dtype="int32")
+    linhas = np.arange(n_militares)
+    for col_ini, col_fim, _, _ in blocos:
+        if col_ini not in datas_blocos or col_fim not in datas_blocos:
+            continue
+        ini = datas_blocos[col_ini].to_numpy(dtype="datetime64[ns]")
+        fim = datas_blocos[col_fim].to_numpy(dtype="datetime64[ns]")
+        validos = ~(np.isnat(ini) | np.isnat(fim))
+        d_ini = np.where(validos, ini, base).astype("datetime64[D]")
+        d_fim = np.where(validos, fim, base).astype("datetime64[D]")
+        p_ini = np.clip((d_ini - base).astype("int64"), 0, n_dias)
+        p_fim = np.clip((d_fim - base).astype("int64"), -1, n_dias - 1)
+        ok = validos & (p_ini <= p_fim)
+        np.add.at(delta, (linhas[ok], p_ini[ok]), 1)
+        np.add.at(delta, (linhas[ok], p_fim[ok] + 1), -1)
+    return np.cumsum(delta, axis=1)[:, :n_dias] > 0
+
+def ausentes_no_dia_matriz(data_ref) -> np.ndarray:
+    """Coluna de data_ref na matriz de ausência do ano (um bool por linha de df_raw)."""
+    data_ref = pd.Timestamp(data_ref)
+    matriz = matriz_ausencia_ano(obter_datas_blocos(), obter_blocos(), len(obter_df_raw()), data_ref.year, obter_versao())
+    return matriz[:, data_ref.dayofyear - 1]
+
+def membros_servicos(df: pd.DataFrame, target_col: str, servicos) -> dict:
+    """
+    Vetor booleano (por linha de df) de quem concorre a cada serviço: coluna que
+    contém o nome do serviço ou, se ninguém casar, igual a ele.
+    """
+    col = df[target_col].astype(str)
+    membros = {}
+    for servico in servicos:
+        mascara = col.str.contains(servico, case=False, regex=False, na=False)
+        if not mascara.any():
+            mascara = col == servico
+        membros[servico] = mascara.to_numpy(dtype=bool)
+    return membros
+
+def escala_nx1(total: int, ausentes: int) -> str:
+    """Escala "Nx1": disponíveis menos o que está de serviço."""
+    return f"{max(0, max(0, total - ausentes) - 1)}x1"
 
 
 # ============================================================
@@ -1629,31 +3036,26 @@ def get_status_em_data(row, data_ref, blocos_cols):
 # ============================================================
 
 def filtrar_tripulacao(df: pd.DataFrame, apenas_eqman: bool, apenas_in: bool, apenas_gvi: bool, divisao: str = "Todos") -> pd.DataFrame:
-    res = df.copy()
-    if divisao != "Todos" and "Divisão" in res.columns:
-        res = res[res["Divisão"].astype(str).str.strip().str.upper() == divisao.strip().upper()]
-    if apenas_eqman and "EqMan" in res.columns:
-        res = res[(res["EqMan"].notna()) & (res["EqMan"].astype(str) != "Não") & (res["EqMan"].astype(str) != "-")]
-    if apenas_in and "IN" in res.columns:
-        res = res[res["IN"].apply(parse_bool)]
-    if apenas_gvi and "Gvi/GP" in res.columns:
-        res = res[res["Gvi/GP"].apply(parse_bool)]
-    return res
+    """df_raw (ou recorte dele) na divisão (partição em cache) e com um E das máscaras de flags_tripulacao."""
+    if divisao != "Todos" and "Divisão" in df.columns:
+        df = da_divisao(df, divisao, "tripulacao")
+    flags = obter_flags().loc[df.index]
+    mascara = np.ones(len(df), dtype=bool)
+    if apenas_eqman and "EqMan" in df.columns:
+        mascara &= flags["is_eqman"].to_numpy()
+    if apenas_in and "IN" in df.columns:
+        mascara &= flags["is_in"].to_numpy()
+    if apenas_gvi and "Gvi/GP" in df.columns:
+        mascara &= flags["is_gvi"].to_numpy()
+    return df[mascara].copy()
 
 def filtrar_eventos(df: pd.DataFrame, apenas_eqman: bool, apenas_in: bool, apenas_gvi: bool, divisao: str = "Todos") -> pd.DataFrame:
-    res = df.copy()
+    """df_eventos (ou recorte dele) filtrado; a divisão vem da partição em cache."""
+    # da_divisao antes da cópia: com o próprio df_eventos ela usa iloc direto na partição
+    res = df
     if divisao != "Todos" and "Divisão" in res.columns:
-        res = res[res["Divisão"].astype(str).str.strip().str.upper() == divisao.strip().upper()]
-    if apenas_eqman:
-        res = res[res["EqMan"] != "Não"]
-    if apenas_in:
-        res = res[res["IN"] == True]
-    if apenas_gvi:
-        res = res[res["GVI"] == True]
-    return res
-
-def filtrar_dias(df: pd.DataFrame, apenas_eqman: bool, apenas_in: bool, apenas_gvi: bool) -> pd.DataFrame:
-    res = df.copy()
+        res = da_divisao(res, divisao, "eventos")
+    res = res.copy()
     if apenas_eqman:
         res = res[res["EqMan"] != "Não"]
     if apenas_in:
@@ -1677,6 +3079,93 @@ def update_fig_layout(fig, title=None):
     return fig
 
 
+# ============================================================
+# 7.2 LISTAS EM HTML ÚNICO (AGENDA / ORGANOGRAMA)
+# ============================================================
+# Cada st.markdown vira uma mensagem separada para o navegador. As listas da
+# Agenda e do Organograma são montadas como UMA string HTML, com o estilo em
+# classes compartilhadas (a cor de cada item vai na variável CSS --cor), e
+# enviadas num único st.markdown.
+
+CSS_AGENDA = """<style>
+.ag-item{margin-bottom:10px;background-color:rgba(255,255,255,0.05);border-radius:6px;border-left:5px solid var(--cor);box-shadow:0 2px 4px rgba(0,0,0,0.1);}
+.ag-resumo{padding:12px 15px;cursor:pointer;display:flex;align-items:center;list-style:none;}
+.ag-hora{font-weight:bold;font-family:monospace;margin-right:8px;color:var(--cor);min-width:55px;}
+.ag-data{min-width:70px;}
+.ag-titulo{font-weight:500;font-size:1rem;}
+.ag-sub{font-size:0.75rem;color:#888;margin-top:2px;}
+.ag-desc{padding:10px 15px;border-top:1px solid rgba(255,255,255,0.1);font-size:0.9rem;color:#ccc;white-space:pre-wrap;}
+</style>"""
+
+CSS_ORGANOGRAMA = """<style>
+.org-node{background-color:rgba(255,255,255,0.07);border:1px solid rgba(128,128,128,0.2);border-radius:8px;padding:15px;text-align:center;margin:10px auto;width:90%;font-weight:600;box-shadow:0 4px 6px rgba(0,0,0,0.1);transition:transform 0.2s;}
+.org-node:hover{transform:scale(1.02);}
+.org-membro{font-size:0.9em;font-weight:normal;}
+.org-cargo{font-weight:normal;font-size:0.9em;opacity:0.8;}
+.org-seta{text-align:center;font-size:24px;color:var(--text-color);opacity:0.4;}
+.org-divisoes{display:grid;grid-template-columns:repeat(auto-fit,minmax(220px,1fr));gap:1rem;margin-top:30px;}
+.cmd-node{width:50%;max-width:300px;border-top:4px solid #f97316;}
+.imed-node{width:50%;max-width:300px;border-top:4px solid #3b82f6;}
+.arm-node{border-left:4px solid #ef4444;}
+.ope-node{border-left:4px solid #10b981;}
+.maq-node{border-left:4px solid #8b5cf6;}
+.div-title{text-align:center;font-size:1.1rem;font-weight:600;margin-bottom:15px;color:var(--text-color);opacity:0.9;border-bottom:2px solid rgba(128,128,128,0.2);padding-bottom:5px;}
+</style>"""
+
+AGENDA_POR_PAGINA = 25
+
+def html_item_agenda(rotulo, titulo, descricao, cor, subtitulo="", classe_rotulo=""):
+    """
+    Um evento como <details> com classes compartilhadas. Rótulo vazio
+    (evento de dia inteiro) omite o bloco de horário.
+    """
+    rotulo_html = f'<div class="ag-hora {classe_rotulo}">{rotulo}</div>' if rotulo else ""
+    sub_html = f'<div class="ag-sub">{subtitulo}</div>' if subtitulo else ""
+    desc_html = descricao if descricao else "<i>Sem descrição.</i>"
+    return (
+        f'<details class="ag-item" style="--cor:{cor};">'
+        f'<summary class="ag-resumo">{rotulo_html}'
+        f'<div class="ag-titulo">{titulo}{sub_html}</div></summary>'
+        f'<div class="ag-desc">{desc_html}</div></details>'
+    )
+
+def render_lista_agenda(itens, chave):
+    """
+    Envia a lista inteira num único st.markdown. Meses longos são exibidos em
+    janelas de AGENDA_POR_PAGINA itens (o Streamlit não virtualiza rolagem),
+    com seletor de página.
+    """
+    total = len(itens)
+    ini, fim = 0, total
+    if total > AGENDA_POR_PAGINA:
+        n_paginas = -(-total // AGENDA_POR_PAGINA)
+        pagina_lista = st.number_input("Página", min_value=1, max_value=n_paginas, value=1, key=chave)
+        ini = (int(pagina_lista) - 1) * AGENDA_POR_PAGINA
+        fim = min(ini + AGENDA_POR_PAGINA, total)
+        st.caption(f"Mostrando {ini + 1}–{fim} de {total} eventos")
+    st.markdown(CSS_AGENDA + "".join(itens[ini:fim]), unsafe_allow_html=True)
+
+def html_organograma(comandante, imediato, divisoes):
+    """
+    Organograma completo numa string: comando, imediato e as divisões lado a
+    lado em grid. `divisoes` é uma lista de (título, cor, classe, membros).
+    """
+    partes = [
+        CSS_ORGANOGRAMA,
+        f'<div class="org-node cmd-node">Comandante<br><span class="org-cargo">{comandante["Nome"]}</span></div>',
+        '<div class="org-seta">↓</div>',
+        f'<div class="org-node imed-node">Imediato<br><span class="org-cargo">{imediato["Nome"]}</span></div>',
+        '<div class="org-seta">↓</div>',
+        '<div class="org-divisoes">',
+    ]
+    for titulo, cor, classe, membros in divisoes:
+        partes.append(f'<div><div class="div-title" style="border-bottom-color: {cor};">{titulo}</div>')
+        partes.extend(f'<div class="org-node {classe} org-membro">{m["Nome"]}</div>' for m in membros)
+        partes.append("</div>")
+    partes.append("</div>")
+    return "".join(partes)
+
+
 
 
 # ============================================================
@@ -1799,11 +3288,11 @@ with st.sidebar.container():
 # ============================================================
 
 def exibir_metricas_globais(data_referencia):
+    df_raw = obter_df_raw()
+    df_eventos, INDICE_EVENTOS = obter_eventos()
     hoje_ref = pd.to_datetime(data_referencia)
     if not df_eventos.empty:
-        ausentes_hoje_global = df_eventos[
-            (df_eventos["Inicio"] <= hoje_ref) & (df_eventos["Fim"] >= hoje_ref)
-        ]
+        ausentes_hoje_global = ausentes_em(df_eventos, hoje_ref, INDICE_EVENTOS)
     else:
         ausentes_hoje_global = pd.DataFrame()
 
@@ -1829,6 +3318,8 @@ hoje_padrao = datetime.today()
 # PRESENTES
 # --------------------------------------------------------
 if pagina == "Presentes":
+    df_raw = obter_df_raw()
+    df_eventos, INDICE_EVENTOS = obter_eventos()
     st.subheader("Presentes a bordo")
     metrics_placeholder = st.container()
     table_placeholder = st.container()
@@ -1851,7 +3342,7 @@ if pagina == "Presentes":
     with table_placeholder:
         df_trip = filtrar_tripulacao(df_raw, apenas_eqman, apenas_in, apenas_gvi, divisao_sel)
         if not df_eventos.empty:
-            ausentes_hoje = df_eventos[(df_eventos["Inicio"] <= hoje) & (df_eventos["Fim"] >= hoje)]
+            ausentes_hoje = ausentes_em(df_eventos, hoje, INDICE_EVENTOS)
             ausentes_hoje = filtrar_eventos(ausentes_hoje, apenas_eqman, apenas_in, apenas_gvi, divisao_sel)
             nomes_ausentes = set(ausentes_hoje["Nome"].unique())
         else:
@@ -1864,10 +3355,11 @@ if pagina == "Presentes":
             st.info("Nenhum militar presente para os filtros atuais.")
         else:
             tabela = df_presentes[["Posto", "Nome", "Divisão", "Serviço", "EqMan", "Gvi/GP", "IN"]].copy()
+            flags_presentes = obter_flags().loc[tabela.index]
             if "Gvi/GP" in tabela.columns:
-                tabela["GVI/GP"] = tabela["Gvi/GP"].apply(lambda v: "Sim" if parse_bool(v) else "Não")
+                tabela["GVI/GP"] = np.where(flags_presentes["is_gvi"], "Sim", "Não")
             if "IN" in tabela.columns:
-                tabela["IN"] = tabela["IN"].apply(lambda v: "Sim" if parse_bool(v) else "Não")
+                tabela["IN"] = np.where(flags_presentes["is_in"], "Sim", "Não")
             if "Gvi/GP" in tabela.columns:
                 tabela = tabela.drop(columns=["Gvi/GP"])
             st.dataframe(tabela, use_container_width=True, hide_index=True)
@@ -1896,7 +3388,7 @@ if pagina == "Presentes":
         # Recula todos os presentes usando a Divisão="Todos" para torná-la 100% independente do filtro primário
         df_trip_indep = filtrar_tripulacao(df_raw, apenas_eqman, apenas_in, apenas_gvi, "Todos")
         if not df_eventos.empty:
-            ausentes_hoje_indep = df_eventos[(df_eventos["Inicio"] <= hoje) & (df_eventos["Fim"] >= hoje)]
+            ausentes_hoje_indep = ausentes_em(df_eventos, hoje, INDICE_EVENTOS)
             ausentes_hoje_indep = filtrar_eventos(ausentes_hoje_indep, apenas_eqman, apenas_in, apenas_gvi, "Todos")
             nomes_ausentes_indep = set(ausentes_hoje_indep["Nome"].unique())
         else:
@@ -1905,12 +3397,12 @@ if pagina == "Presentes":
         df_presentes_indep = df_trip_indep[~df_trip_indep["Nome"].isin(nomes_ausentes_indep)].copy()
         
         if "Divisão" in df_presentes_indep.columns:
-            df_div = df_presentes_indep[df_presentes_indep["Divisão"].astype(str).str.strip().str.upper() == div_consulta.upper()].copy()
+            df_div = da_divisao(df_presentes_indep, div_consulta, "tripulacao").copy()
             if not df_div.empty:
                 st.markdown(f"**Total presente na {div_consulta}:** {len(df_div)}")
                 tab_consulta = df_div[["Posto", "Nome", "Divisão", "Serviço", "EqMan", "IN"]].copy()
                 if "IN" in tab_consulta.columns:
-                    tab_consulta["IN"] = tab_consulta["IN"].apply(lambda v: "Sim" if parse_bool(v) else "Não")
+                    tab_consulta["IN"] = np.where(obter_flags().loc[tab_consulta.index, "is_in"], "Sim", "Não")
                 st.dataframe(tab_consulta, use_container_width=True, hide_index=True)
             else:
                 st.info(f"Nenhum militar presente listado para a divisão {div_consulta}.")
@@ -1919,6 +3411,8 @@ if pagina == "Presentes":
 # AUSENTES
 # --------------------------------------------------------
 elif pagina == "Ausentes":
+    df_eventos, INDICE_EVENTOS = obter_eventos()
+    VERSAO_DADOS = obter_versao()
     st.subheader("Ausentes")
     
     # --- SEÇÃO 1: AUSENTES HOJE (FIXO) ---
@@ -1936,7 +3430,7 @@ elif pagina == "Ausentes":
         apenas_gvi   = c_f3.checkbox("Apenas GVI/GP", key="aus_gvi_hoje")
 
     if not df_eventos.empty:
-        ausentes_hoje = df_eventos[(df_eventos["Inicio"] <= hoje) & (df_eventos["Fim"] >= hoje)]
+        ausentes_hoje = ausentes_em(df_eventos, hoje, INDICE_EVENTOS)
         ausentes_hoje = filtrar_eventos(ausentes_hoje, apenas_eqman, apenas_in, apenas_gvi)
         
         if not ausentes_hoje.empty:
@@ -1963,8 +3457,7 @@ elif pagina == "Ausentes":
 
     if not df_eventos.empty:
         # Filtra eventos que têm intersecção com o período selecionado
-        mask_periodo = (df_eventos["Inicio"] <= dt_fim) & (df_eventos["Fim"] >= dt_ini)
-        ausentes_periodo = df_eventos[mask_periodo]
+        ausentes_periodo = eventos_no_periodo(df_eventos, dt_ini, dt_fim, INDICE_EVENTOS)
         ausentes_periodo = filtrar_eventos(ausentes_periodo, apenas_eqman, apenas_in, apenas_gvi)
 
         if not ausentes_periodo.empty:
@@ -1980,13 +3473,12 @@ elif pagina == "Ausentes":
     st.markdown("---")
     
     
-    if not df_dias.empty:
-        df_dias_filt = filtrar_dias(df_dias, apenas_eqman, apenas_in, apenas_gvi)
+    if not df_eventos.empty:
+        df_ev_filt = filtrar_eventos(df_eventos, apenas_eqman, apenas_in, apenas_gvi)
         
-        if not df_dias_filt.empty:
+        if not df_ev_filt.empty:
             st.subheader("Quantidade de militares ausentes por mês")
-            df_dias_filt["Mes"] = df_dias_filt["Data"].dt.to_period("M").dt.to_timestamp()
-            df_aus_mes = (df_dias_filt[["Mes", "Nome"]].drop_duplicates().groupby("Mes")["Nome"].nunique().reset_index(name="Militares"))
+            df_aus_mes = militares_por_mes(fatia_cubo(obter_cubo()["mes"], apenas_eqman, apenas_in, apenas_gvi))
             
             st.markdown("##### Ausentes por mês (Geral)")
             # Format dates for x-axis
@@ -2015,18 +3507,14 @@ elif pagina == "Ausentes":
             else:
                 end_date = datetime(sel_ano_aus, sel_mes_aus + 1, 1)
                 
-            df_dias_mes = df_dias_filt[
-                (df_dias_filt["Data"] >= start_date) & 
-                (df_dias_filt["Data"] < end_date)
-            ].copy()
+            aus_dia_mes = ausentes_por_dia(df_ev_filt, start_date, end_date - timedelta(days=1))
             
-            if df_dias_mes.empty:
+            if aus_dia_mes.empty:
                 st.info(f"Sem registros de ausência para {sel_mes_nome_aus}/{sel_ano_aus}.")
             else:
-                ausentes_mes_evt = df_eventos[
-                    (df_eventos["Inicio"] < end_date) &
-                    (df_eventos["Fim"] >= start_date)
-                ].copy()
+                ausentes_mes_evt = eventos_no_periodo(
+                    df_eventos, start_date, end_date - timedelta(days=1), INDICE_EVENTOS
+                ).copy()
                 
                 ausentes_mes_evt = filtrar_eventos(ausentes_mes_evt, apenas_eqman, apenas_in, apenas_gvi)
                 
@@ -2043,7 +3531,7 @@ elif pagina == "Ausentes":
                     tabela_mes = tabela_mes.sort_values(by=["Nome"])
                     st.dataframe(tabela_mes, use_container_width=True, hide_index=True)
                 
-                df_aus_dia = (df_dias_mes.groupby("Data")["Nome"].nunique().reset_index(name="Militares"))
+                df_aus_dia = aus_dia_mes.rename_axis("Data").reset_index(name="Militares")
                 
                 st.markdown(f"##### Ausências diárias em {sel_mes_nome_aus}/{sel_ano_aus}")
                 x_dates_dia = df_aus_dia["Data"].dt.strftime("%d/%m").tolist()
@@ -2058,7 +3546,7 @@ elif pagina == "Ausentes":
     
     # --- CONFLITOS DE AUSÊNCIA POR GRUPO (MOVIDO DA ABA FÉRIAS) ---
     st.markdown("### Conflitos de Ausência por Grupo")
-    df_conflitos = detectar_conflitos(df_eventos)
+    df_conflitos = detectar_conflitos(df_eventos, VERSAO_DADOS)
     
     if not df_conflitos.empty:
         # Formata e exibe
@@ -2099,9 +3587,8 @@ elif pagina == "Ausentes":
             
             # Só avisa de eventos que ainda não passaram
             if fim_evento >= hoje:
-                # Extrai apenas as datas para comparação
-                mask_intersecao = (df_eventos["Inicio"].dt.date <= fim_evento) & (df_eventos["Fim"].dt.date >= ini_evento)
-                ausentes_no_evento = df_eventos[mask_intersecao]
+                # Eventos que tocam o período do evento importante (via índice de intervalos)
+                ausentes_no_evento = eventos_no_periodo(df_eventos, ini_evento, fim_evento, INDICE_EVENTOS)
                 
                 if not ausentes_no_evento.empty:
                     # Agrupar nomes com seus respectivos motivos
@@ -2307,7 +3794,6 @@ elif pagina == "Trocar Senha":
                         # Tudo ok, atualizar
                         if update_password(current_user_nip, new_pass):
                             st.success("Senha atualizada com sucesso! Você será deslogado em instantes.")
-                            import time
                             time.sleep(2)
                             st.session_state.clear()
                             st.rerun()
@@ -2330,52 +3816,10 @@ else:
         if not events_today:
             st.info("Nenhum evento programado para hoje.")
         else:
-            for ev in events_today:
-                # Lógica de display do horário: se vazio, display:none
-                time_display_style = "display: block;" if ev['Hora'] else "display: none;"
-                
-                st.markdown(
-                    f"""
-                    <details style="
-                        margin-bottom: 10px; 
-                        background-color: rgba(255,255,255,0.05); 
-                        border-radius: 6px;
-                        border-left: 5px solid {ev['Cor']};
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    ">
-                        <summary style="
-                            padding: 12px 15px; 
-                            cursor: pointer;
-                            display: flex; 
-                            align-items: center;
-                            list-style: none; /* Remove triângulo padrão */
-                        ">
-                            <div style="
-                                font-weight: bold; 
-                                font-family: monospace; 
-                                margin-right: 8px; 
-                                color: {ev['Cor']};
-                                min-width: 55px;
-                                {time_display_style}
-                            ">{ev['Hora']}</div>
-                            <div style="font-weight: 500; font-size: 1rem;">
-                                {ev['Evento']}
-                                <div style="font-size: 0.75rem; color: #888; margin-top: 2px;">{ev['Agenda']}</div>
-                            </div>
-                        </summary>
-                        <div style="
-                            padding: 10px 15px; 
-                            border-top: 1px solid rgba(255,255,255,0.1);
-                            font-size: 0.9rem;
-                            color: #ccc;
-                            white-space: pre-wrap;
-                        ">
-                            {ev['Descricao'] if ev['Descricao'] else '<i>Sem descrição.</i>'}
-                        </div>
-                    </details>
-                    """,
-                    unsafe_allow_html=True
-                )
+            render_lista_agenda([
+                html_item_agenda(ev["Hora"], ev["Evento"], ev["Descricao"], ev["Cor"], subtitulo=ev["Agenda"])
+                for ev in events_today
+            ], chave="ag_pag_hoje")
         
         st.markdown("---")
     
@@ -2424,58 +3868,15 @@ else:
     
                 cal_color = AGENDA_COLORS.get(nome_agenda, "#999999")
                 
-                for _, row in df_cal.iterrows():
-                    # Extrair hora se houver (formato DD/MM HH:MM)
-                    hora_display = ""
-                    data_display = row['Data']
-                    descricao = row.get('Descricao', '')
-                    
-                    # Tenta separar hora da data se possível, ou exibe data completa
-                    # O helper load_calendar_events retorna 'Data' já formatada.
-                    # Vamos manter simples: Data na esquerda (onde ficava a hora)
-                    
-                    st.markdown(
-                        f"""
-                        <details style="
-                            margin-bottom: 10px; 
-                            background-color: rgba(255,255,255,0.05); 
-                            border-radius: 6px;
-                            border-left: 5px solid {cal_color};
-                            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                        ">
-                            <summary style="
-                                padding: 12px 15px; 
-                                cursor: pointer;
-                                display: flex; 
-                                align-items: center;
-                                list-style: none;
-                            ">
-                                <div style="
-                                    font-weight: bold; 
-                                    font-family: monospace; 
-                                    margin-right: 8px; 
-                                    color: {cal_color};
-                                    min-width: 70px;
-                                ">{data_display}</div>
-                                <div style="font-weight: 500; font-size: 1rem;">
-                                    {row['Evento']}
-                                </div>
-                            </summary>
-                            <div style="
-                                padding: 10px 15px; 
-                                border-top: 1px solid rgba(255,255,255,0.1);
-                                font-size: 0.9rem;
-                                color: #ccc;
-                                white-space: pre-wrap;
-                            ">
-                                {descricao if descricao else '<i>Sem descrição.</i>'}
-                            </div>
-                        </details>
-                        """,
-                        unsafe_allow_html=True
-                    )
+                # Data na esquerda (onde ficava a hora); 'Data' já vem formatada
+                render_lista_agenda([
+                    html_item_agenda(data, evento, descricao, cal_color, classe_rotulo="ag-data")
+                    for data, evento, descricao in zip(df_cal["Data"], df_cal["Evento"], df_cal["Descricao"])
+                ], chave=f"ag_pag_{nome_agenda}_{sel_mes_nome}_{sel_ano}")
 
     elif pagina == "Linha do Tempo":
+        df_raw = obter_df_raw()
+        df_eventos, INDICE_EVENTOS = obter_eventos()
         st.subheader("Planejamento Anual de Ausências")
         content_container = st.container()
         with content_container:
@@ -2509,11 +3910,13 @@ else:
                     st.plotly_chart(fig, use_container_width=True)
 
     elif pagina == "Equipes Operativas":
+        df_raw = obter_df_raw()
+        flags = obter_flags()
         st.subheader("Equipes Operativas")
         col_eq1, col_eq2, col_eq3 = st.columns(3)
         with col_eq1:
             st.markdown("### GVI/GP")
-            df_gvi = df_raw[df_raw["Gvi/GP"].apply(parse_bool)].copy()
+            df_gvi = df_raw[flags["is_gvi"]].copy()
             if df_gvi.empty:
                 st.info("Nenhum militar no GVI/GP.")
             else:
@@ -2521,7 +3924,7 @@ else:
                 st.markdown(f"**Total:** {len(df_gvi)}")
         with col_eq2:
             st.markdown("### Inspetores Navais")
-            df_in = df_raw[df_raw["IN"].apply(parse_bool)].copy()
+            df_in = df_raw[flags["is_in"]].copy()
             if df_in.empty:
                 st.info("Nenhum Inspetor Naval.")
             else:
@@ -2529,7 +3932,7 @@ else:
                 st.markdown(f"**Total:** {len(df_in)}")
         with col_eq3:
             st.markdown("### EqMan")
-            df_eqman = df_raw[(df_raw["EqMan"].notna()) & (df_raw["EqMan"] != "Não") & (df_raw["EqMan"] != "-")].copy()
+            df_eqman = df_raw[flags["is_eqman"]].copy()
             if df_eqman.empty:
                 st.info("Nenhum militar na EqMan.")
             else:
@@ -2537,6 +3940,7 @@ else:
                 st.markdown(f"**Total:** {len(df_eqman)}")
 
     elif pagina == "Estatísticas & Análises":
+        df_eventos, INDICE_EVENTOS = obter_eventos()
         st.subheader("Visão Analítica de Ausências")
         content_container = st.container()
         with content_container:
@@ -2549,15 +3953,15 @@ else:
                 else:
                     col_a1, col_a2, col_a3 = st.columns(3)
                     total_dias_ausencia = df_evt["Duracao_dias"].sum()
-                    media_dias_por_militar = df_evt.groupby("Nome")["Duracao_dias"].sum().mean()
+                    media_dias_por_militar = df_evt.groupby("Nome", observed=True)["Duracao_dias"].sum().mean()
                     df_ferias_evt = df_evt[df_evt["Tipo"] == "Férias"].copy()
-                    media_dias_ferias = (df_ferias_evt.groupby("Nome")["Duracao_dias"].sum().mean() if not df_ferias_evt.empty else 0)
+                    media_dias_ferias = (df_ferias_evt.groupby("Nome", observed=True)["Duracao_dias"].sum().mean() if not df_ferias_evt.empty else 0)
                     col_a1.metric("Dias de ausência (total)", int(total_dias_ausencia))
                     col_a2.metric("Média de dias de ausência por militar", f"{media_dias_por_militar:.1f}")
                     col_a3.metric("Média de dias de férias por militar", f"{media_dias_ferias:.1f}")
                     st.markdown("---")
     
-                    df_motivos_dias = (df_evt.groupby("MotivoAgrupado")["Duracao_dias"].sum().reset_index().sort_values("Duracao_dias", ascending=False))
+                    df_motivos_dias = (df_evt.groupby("MotivoAgrupado", observed=True)["Duracao_dias"].sum().reset_index().sort_values("Duracao_dias", ascending=False))
                     
                     # ECHARTS DONUT (VISÃO ANALÍTICA)
                     data_motivos = [
@@ -2574,15 +3978,12 @@ else:
                     # st.markdown("##### Top 10 – Dias de ausência por militar")
                     # opt_top10 = make_echarts_bar(df_top10["Nome"].tolist(), df_top10["Duracao_dias"].tolist())
                     # st_echarts(options=opt_top10, height="500px")
-                    if not df_dias.empty:
+                    if not df_eventos.empty:
                         st.markdown("---")
     
                         st.subheader("Média de militares ausentes por dia (por mês)")
-                        df_dias_filtrado = df_dias.copy()
-                        if not df_dias_filtrado.empty:
-                            df_diario = (df_dias_filtrado.groupby("Data")["Nome"].nunique().reset_index(name="Ausentes"))
-                            df_diario["Mes"] = df_diario["Data"].dt.to_period("M").dt.to_timestamp()
-                            df_mensal = (df_diario.groupby("Mes")["Ausentes"].mean().reset_index(name="Media_ausentes_dia"))
+                        df_mensal = obter_cubo()["media_dia"]
+                        if not df_mensal.empty:
                             st.markdown("##### Média de Ausentes por Dia – por Mês")
                             # Format dates for x-axis
                             x_dates = df_mensal["Mes"].dt.strftime("%b/%Y").tolist()
@@ -2592,10 +3993,12 @@ else:
                             st.info("Sem dados diários para análise mensal.")
 
     elif pagina == "Férias":
+        df_raw = obter_df_raw()
+        df_eventos, INDICE_EVENTOS = obter_eventos()
         st.subheader("Férias cadastradas")
         content_container = st.container()
         with content_container:
-            def render_ferias_aba(df_eventos_l, df_raw_l, df_dias_l, key_suffix=""):
+            def render_ferias_aba(df_eventos_l, df_raw_l, key_suffix="", divisao="Todos"):
                 if df_eventos_l.empty:
                     st.write("Sem dados de férias registrados para esta visão.")
                 else:
@@ -2672,8 +4075,12 @@ else:
                             start_of_month = datetime(sel_ano, sel_mes, 1)
                             end_of_month = datetime(sel_ano, sel_mes, last_day, 23, 59, 59)
                             
-                            mask = (df_ferias["Inicio"] <= end_of_month) & (df_ferias["Fim"] >= start_of_month)
-                            res_mes = df_ferias[mask].copy()
+                            # Consulta o índice compartilhado (df_eventos inteiro) e só então recorta
+                            res_mes = eventos_no_periodo(df_eventos, start_of_month, end_of_month, INDICE_EVENTOS)
+                            res_mes = res_mes[res_mes["Tipo"] == "Férias"]
+                            if divisao != "Todos" and "Divisão" in df_eventos.columns:
+                                res_mes = da_divisao(res_mes, divisao, "eventos")
+                            res_mes = res_mes.copy()
                             
                             if not res_mes.empty:
                                  res_mes["Início"] = res_mes["Inicio"].dt.strftime("%d/%m/%Y")
@@ -2697,12 +4104,11 @@ else:
                         st.markdown("---")
         
                         # --- GRÁFICO 1: % de militares de férias por mês ---
-                        if not df_dias_l.empty:
-                            df_dias_ferias = df_dias_l[df_dias_l["Tipo"] == "Férias"].copy()
-                            if not df_dias_ferias.empty:
-                                df_dias_ferias["Mes"] = df_dias_ferias["Data"].dt.to_period("M").dt.to_timestamp()
-                                df_mes_ferias = (df_dias_ferias[["Mes", "Nome"]].drop_duplicates()
-                                                 .groupby("Mes")["Nome"].nunique().reset_index(name="Militares"))
+                        if not df_eventos_l.empty:
+                            # Séries de férias da aba: fatia do cubo mensal, em cache por divisão e versão
+                            series = series_ferias(obter_cubo()["mes"], obter_versao(), divisao, tuple(SERVICOS_CONSIDERADOS))
+                            df_mes_ferias = series["militares_mes"].copy()
+                            if not df_mes_ferias.empty:
                                 total_efetivo_ferias = df_raw_l["Nome"].nunique()
                                 df_mes_ferias["Perc"] = (df_mes_ferias["Militares"] / total_efetivo_ferias * 100).round(1) if total_efetivo_ferias > 0 else 0
     
@@ -2724,21 +4130,11 @@ else:
         
                                 # --- GRÁFICO 2: Férias por serviço por mês (barras agrupadas) ---
                                 st.markdown("##### Militares de férias por serviço (por mês)")
-                                servicos_filtro = SERVICOS_CONSIDERADOS
-                                df_dias_ferias_srv = df_dias_ferias[df_dias_ferias["Escala"].isin(servicos_filtro)].copy()
-                                if not df_dias_ferias_srv.empty:
-                                    df_srv_mes = (df_dias_ferias_srv[["Mes", "Nome", "Escala"]].drop_duplicates()
-                                                  .groupby(["Mes", "Escala"])["Nome"].nunique().reset_index(name="Militares"))
-                                    meses_unicos = sorted(df_srv_mes["Mes"].unique())
+                                df_srv_mes = series["por_servico"]
+                                if not df_srv_mes.empty:
                                     mapa_meses_abrev = {1:"Jan",2:"Fev",3:"Mar",4:"Abr",5:"Mai",6:"Jun",7:"Jul",8:"Ago",9:"Set",10:"Out",11:"Nov",12:"Dez"}
-                                    x_meses = [mapa_meses_abrev.get(m.month, str(m.month)) + "/" + str(m.year) for m in meses_unicos]
-                                    series_srv = []
-                                    for srv in servicos_filtro:
-                                        vals = []
-                                        for m in meses_unicos:
-                                            v = df_srv_mes[(df_srv_mes["Mes"] == m) & (df_srv_mes["Escala"] == srv)]["Militares"].sum()
-                                            vals.append(int(v))
-                                        series_srv.append({"name": srv, "data": vals})
+                                    x_meses = [mapa_meses_abrev.get(m.month, str(m.month)) + "/" + str(m.year) for m in df_srv_mes.index]
+                                    series_srv = [{"name": srv, "data": df_srv_mes[srv].tolist()} for srv in df_srv_mes.columns]
                                     opt_grouped = make_echarts_grouped_bar(x_meses, series_srv)
                                     st_echarts(options=opt_grouped, height="500px", key="groupgraf"+key_suffix)
                                 else:
@@ -2752,17 +4148,16 @@ else:
                                     df_metas, ano_ref_metas = load_metas()
                                     if not df_metas.empty and ano_ref_metas:
                                         st.caption(f"Ano de referência: **{ano_ref_metas}**")
-                                        df_ferias_ano = df_dias_ferias[df_dias_ferias["Data"].dt.year == ano_ref_metas].copy()
                                         total_efetivo_meta = df_raw_l["Nome"].nunique()
                                         total_dias_esperado = total_efetivo_meta * 30
     
-                                        realizado_acum = []
-                                        dias_acumulados = 0
-                                        for mes_num in range(1, 13):
-                                            dias_mes = len(df_ferias_ano[df_ferias_ano["Data"].dt.month == mes_num])
-                                            dias_acumulados += dias_mes
-                                            perc = (dias_acumulados / total_dias_esperado * 100) if total_dias_esperado > 0 else 0
-                                            realizado_acum.append(round(perc, 1))
+                                        # Dias-militar de férias acumulados no ano (eventos sobrepostos contam cada um)
+                                        acumulados = series["dias_acumulados"]
+                                        dias_acumulados = acumulados.loc[ano_ref_metas].tolist() if ano_ref_metas in acumulados.index else [0] * 12
+                                        realizado_acum = [
+                                            round((d / total_dias_esperado * 100) if total_dias_esperado > 0 else 0, 1)
+                                            for d in dias_acumulados
+                                        ]
     
                                         x_metas = df_metas["Mes"].tolist()
                                         y_metas = df_metas["Meta"].tolist()
@@ -2777,16 +4172,16 @@ else:
 
             abas = st.tabs(["Geral", "Divisão"])
             with abas[0]:
-                render_ferias_aba(df_eventos, df_raw, df_dias, "Geral")
+                render_ferias_aba(df_eventos, df_raw, "Geral")
             with abas[1]:
                 st.markdown("#### Filtrar por Divisão")
                 divisao_sel_ferias = st.selectbox("Selecione a Divisão", ["Comandante", "Imediato", "OPE", "ARM", "MAQ"], key="feriasdivisaosel")
                 
-                d_eventos_div = df_eventos[df_eventos["Divisão"].astype(str).str.strip().str.upper() == divisao_sel_ferias.upper()].copy() if "Divisão" in df_eventos.columns else df_eventos.copy()
-                d_raw_div = df_raw[df_raw["Divisão"].astype(str).str.strip().str.upper() == divisao_sel_ferias.upper()].copy() if "Divisão" in df_raw.columns else df_raw.copy()
-                d_dias_div = df_dias[df_dias["Divisão"].astype(str).str.strip().str.upper() == divisao_sel_ferias.upper()].copy() if "Divisão" in df_dias.columns else df_dias.copy()
+                # Partições por divisão em cache: trocar a divisão é só uma consulta ao dicionário
+                d_eventos_div = da_divisao(df_eventos, divisao_sel_ferias, "eventos").copy() if "Divisão" in df_eventos.columns else df_eventos.copy()
+                d_raw_div = da_divisao(df_raw, divisao_sel_ferias, "tripulacao").copy() if "Divisão" in df_raw.columns else df_raw.copy()
                 
-                render_ferias_aba(d_eventos_div, d_raw_div, d_dias_div, "Divisao")
+                render_ferias_aba(d_eventos_div, d_raw_div, "Divisao", divisao=divisao_sel_ferias)
     
 
     elif pagina == "Adestramento":
@@ -2794,97 +4189,15 @@ else:
         content_container = st.container()
         with content_container:
             try:
-                conn = st.connection("gsheets", type=GSheetsConnection)
-                
                 # Lendo as abas usando header=None para navegar explicitamente por índices de linhas e colunas
-                df_ofi = conn.read(spreadsheet=URL_ADESTRAMENTO, worksheet="GERAL - OFICIAIS", header=None, ttl="10m")
-                df_pra = conn.read(spreadsheet=URL_ADESTRAMENTO, worksheet="GERAL - PRAÇAS", header=None, ttl="10m")
-                df_pqs = conn.read(spreadsheet=URL_ADESTRAMENTO, worksheet="PQS", header=None, ttl="10m")
-                
-                # --- PARSER - OFICIAIS ---
-                # NIP = coluna 2 (index 1), Guerra = coluna 3 (index 2), Completo = coluna 4 (index 3)
-                # Cursos = colunas E:AF (4:32)
-                cursos_ofi = [str(c).strip() for c in df_ofi.iloc[6, 4:32].tolist()]
-                req_ofi = [int(float(x)) if pd.notna(x) and str(x).strip() != "" else 0 for x in df_ofi.iloc[2, 4:32].tolist()]
-                
-                militares_ofi = []
-                for i in range(7, len(df_ofi)):
-                    nip = str(df_ofi.iloc[i, 1]).strip()
-                    if nip.endswith(".0"): nip = nip[:-2]
-                    nip = nip.replace(".", "").replace("-", "").replace(" ", "")
-                    
-                    ng = str(df_ofi.iloc[i, 2]).strip()
-                    if not ng or ng.lower() == "nan": continue
-                    
-                    nc = str(df_ofi.iloc[i, 3]).strip()
-                    mil = {"nip": nip, "guerra": ng, "completo": nc, "cursos": []}
-                    for j in range(4, 32):
-                        if j < len(df_ofi.columns):
-                            val = str(df_ofi.iloc[i, j]).strip()
-                            if val == "1" or val == "1.0":
-                                if j-4 < len(cursos_ofi) and cursos_ofi[j-4].lower() != "nan":
-                                    mil["cursos"].append(cursos_ofi[j-4])
-                    militares_ofi.append(mil)
-                    
-                totais_ofi = [0] * len(cursos_ofi)
-                for mil in militares_ofi:
-                    for c in mil["cursos"]:
-                        if c in cursos_ofi:
-                            idx = cursos_ofi.index(c)
-                            totais_ofi[idx] += 1
-                            
-                # --- PARSER - PRAÇAS ---
-                # Cursos = colunas E:BI (4:61)
-                cursos_pra = [str(c).strip() for c in df_pra.iloc[6, 4:61].tolist()]
-                req_pra = [int(float(x)) if pd.notna(x) and str(x).strip() != "" else 0 for x in df_pra.iloc[2, 4:61].tolist()]
-                
-                militares_pra = []
-                for i in range(7, len(df_pra)):
-                    nip = str(df_pra.iloc[i, 1]).strip()
-                    if nip.endswith(".0"): nip = nip[:-2]
-                    nip = nip.replace(".", "").replace("-", "").replace(" ", "")
-                    
-                    ng = str(df_pra.iloc[i, 2]).strip()
-                    if not ng or ng.lower() == "nan": continue
-                    
-                    nc = str(df_pra.iloc[i, 3]).strip()
-                    mil = {"nip": nip, "guerra": ng, "completo": nc, "cursos": []}
-                    for j in range(4, 61):
-                        if j < len(df_pra.columns):
-                            val = str(df_pra.iloc[i, j]).strip()
-                            if val == "1" or val == "1.0":
-                                if j-4 < len(cursos_pra) and cursos_pra[j-4].lower() != "nan":
-                                    mil["cursos"].append(cursos_pra[j-4])
-                    militares_pra.append(mil)
-                    
-                totais_pra = [0] * len(cursos_pra)
-                for mil in militares_pra:
-                    for c in mil["cursos"]:
-                        if c in cursos_pra:
-                            idx = cursos_pra.index(c)
-                            totais_pra[idx] += 1
-                            
-                # Agrupando dados de cursos formatados
-                dados_cursos_ofi = []
-                for i, c in enumerate(cursos_ofi):
-                    if c and c.lower() != "nan" and c != "":
-                        dados_cursos_ofi.append({"Curso": c, "Real": totais_ofi[i], "Requisito": req_ofi[i]})
-                        
-                dados_cursos_pra = []
-                for i, c in enumerate(cursos_pra):
-                    if c and c.lower() != "nan" and c != "":
-                        dados_cursos_pra.append({"Curso": c, "Real": totais_pra[i], "Requisito": req_pra[i]})
-                        
-                # Consolidação para matemática final
-                dados_cursos = dados_cursos_ofi + dados_cursos_pra
-                
-                deficit_ofi = [d for d in dados_cursos_ofi if d["Real"] < d["Requisito"]]
-                excesso_ofi = [d for d in dados_cursos_ofi if d["Real"] > d["Requisito"]]
-                rmc_ofi     = [d for d in dados_cursos_ofi if d["Real"] == d["Requisito"] and d["Requisito"] > 0]
+                # Matrizes militar × curso já processadas (cache); PQS é lida direto da aba
+                matrizes = load_matriz_adestramento()
+                m_ofi = matrizes["oficiais"]
+                m_pra = matrizes["pracas"]
+                df_pqs = load_adestramento()["PQS"]
                 
-                deficit_pra = [d for d in dados_cursos_pra if d["Real"] < d["Requisito"]]
-                excesso_pra = [d for d in dados_cursos_pra if d["Real"] > d["Requisito"]]
-                rmc_pra     = [d for d in dados_cursos_pra if d["Real"] == d["Requisito"] and d["Requisito"] > 0]
+                dados_cursos_ofi, deficit_ofi, excesso_ofi, rmc_ofi = resumo_cursos(m_ofi)
+                dados_cursos_pra, deficit_pra, excesso_pra, rmc_pra = resumo_cursos(m_pra)
                 
                 # --- VISÃO GLOBAL ---
                 tab_estatistica, tab_militar, tab_pqs = st.tabs(["Estatísticas RMC", "Pesquisa por Militar", "Qualificação PQS"])
@@ -2909,8 +4222,7 @@ else:
                 with tab_estatistica:
                     st.markdown("### Situação dos Cursos: Oficiais")
                     
-                    df_grafico_ofi = pd.DataFrame(dados_cursos_ofi)
-                    df_grafico_ofi = df_grafico_ofi[df_grafico_ofi["Requisito"] > 0]
+                    df_grafico_ofi = dados_cursos_ofi[dados_cursos_ofi["Requisito"] > 0]
                     df_grafico_ofi = df_grafico_ofi.sort_values(by="Requisito", ascending=False).head(20)
                     
                     if not df_grafico_ofi.empty:
@@ -2930,22 +4242,21 @@ else:
                         tb_o1, tb_o2, tb_o3 = st.columns(3)
                         with tb_o1:
                             st.markdown("#### Déficit")
-                            if deficit_ofi: st.dataframe(pd.DataFrame(deficit_ofi), use_container_width=True, hide_index=True)
+                            if not deficit_ofi.empty: st.dataframe(deficit_ofi, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso em déficit.")
                         with tb_o2:
                             st.markdown("#### Excesso")
-                            if excesso_ofi: st.dataframe(pd.DataFrame(excesso_ofi), use_container_width=True, hide_index=True)
+                            if not excesso_ofi.empty: st.dataframe(excesso_ofi, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso em excesso.")
                         with tb_o3:
                             st.markdown("#### Dentro da RMC")
-                            if rmc_ofi: st.dataframe(pd.DataFrame(rmc_ofi), use_container_width=True, hide_index=True)
+                            if not rmc_ofi.empty: st.dataframe(rmc_ofi, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso exato na RMC.")
                         
                     st.markdown("---")
                     st.markdown("### Situação dos Cursos: Praças")
                     
-                    df_grafico_pra = pd.DataFrame(dados_cursos_pra)
-                    df_grafico_pra = df_grafico_pra[df_grafico_pra["Requisito"] > 0]
+                    df_grafico_pra = dados_cursos_pra[dados_cursos_pra["Requisito"] > 0]
                     df_grafico_pra = df_grafico_pra.sort_values(by="Requisito", ascending=False).head(20)
                     
                     if not df_grafico_pra.empty:
@@ -2965,30 +4276,32 @@ else:
                         tb_p1, tb_p2, tb_p3 = st.columns(3)
                         with tb_p1:
                             st.markdown("#### Déficit")
-                            if deficit_pra: st.dataframe(pd.DataFrame(deficit_pra), use_container_width=True, hide_index=True)
+                            if not deficit_pra.empty: st.dataframe(deficit_pra, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso em déficit.")
                         with tb_p2:
                             st.markdown("#### Excesso")
-                            if excesso_pra: st.dataframe(pd.DataFrame(excesso_pra), use_container_width=True, hide_index=True)
+                            if not excesso_pra.empty: st.dataframe(excesso_pra, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso em excesso.")
                         with tb_p3:
                             st.markdown("#### Dentro da RMC")
-                            if rmc_pra: st.dataframe(pd.DataFrame(rmc_pra), use_container_width=True, hide_index=True)
+                            if not rmc_pra.empty: st.dataframe(rmc_pra, use_container_width=True, hide_index=True)
                             else: st.info("Nenhum curso exato na RMC.")
 
                 with tab_militar:
                     st.markdown("### Histórico do Militar")
-                    # Unifica as listas iteráveis para o dropdown
-                    todos_militares = militares_ofi + militares_pra
-                    opcoes_nomes = [f"{m['guerra']} - {m['completo']}" for m in todos_militares]
+                    # Unifica oficiais e praças (só linhas com nome de guerra) para o dropdown
+                    todos_militares = [
+                        (m, i) for m in (m_ofi, m_pra) for i in np.flatnonzero(m["ativos"])
+                    ]
+                    opcoes_nomes = [f"{m['guerras'][i]} - {m['completos'][i]}" for m, i in todos_militares]
                     
                     selecionado = st.selectbox("Selecione o militar:", opcoes_nomes)
                     if selecionado:
-                        militar_obj = next((m for m in todos_militares if f"{m['guerra']} - {m['completo']}" == selecionado), None)
-                        if militar_obj:
-                            st.markdown(f"**Cursos concluídos ({len(militar_obj['cursos'])})**")
-                            for c in militar_obj["cursos"]:
-                                st.write(f"- {c}")
+                        m_sel, i_sel = todos_militares[opcoes_nomes.index(selecionado)]
+                        cursos_sel = cursos_da_linha(m_sel, i_sel)
+                        st.markdown(f"**Cursos concluídos ({len(cursos_sel)})**")
+                        for c in cursos_sel:
+                            st.write(f"- {c}")
                                 
                 with tab_pqs:
                     st.markdown("### Qualificação PQS")
@@ -3058,6 +4371,10 @@ else:
                 st.error(f"Erro ao carregar os dados de Adestramento: {e}")
 
     elif pagina == "Tabela de Serviço":
+        df_raw = obter_df_raw()
+        BLOCOS_DATAS = obter_blocos()
+        DATAS_BLOCOS = obter_datas_blocos()
+        VERSAO_DADOS = obter_versao()
         st.subheader("Tabela de Serviço")
         
         tab_dia, tab_analise = st.tabs(["Tabela do Dia", "Análise"])
@@ -3348,22 +4665,14 @@ else:
                 if not col_escala and "Posto/Grad" not in df_raw.columns:
                     st.error("Não foi possível identificar a coluna de Escala/Serviço para cálculo.")
                 else:
+                    membros = membros_servicos(df_raw, target_col, SERVICOS_CONSIDERADOS)
+                    ausentes_dia = ausentes_no_dia_matriz(dt_ref)
                     daily_data = []
                     for servico in SERVICOS_CONSIDERADOS:
-                        people_in_service = df_raw[df_raw[target_col].astype(str).str.contains(servico, case=False, regex=False)]
-                        if people_in_service.empty:
-                             people_in_service = df_raw[df_raw[target_col].astype(str) == servico]
-                        total = len(people_in_service)
-                        absent = 0
-                        for _, person in people_in_service.iterrows():
-                            status = get_status_em_data(person, dt_ref, BLOCOS_DATAS)
-                            if status != "Presente":
-                                absent += 1
-                        available = max(0, total - absent)
-                        scale_val = max(0, available - 1)
+                        mascara = membros[servico]
                         daily_data.append({
                             "Serviço": servico,
-                            "Escala": f"{scale_val}x1"
+                            "Escala": escala_nx1(int(mascara.sum()), int(ausentes_dia[mascara].sum()))
                         })
                     df_daily = pd.DataFrame(daily_data)
                     def color_scale_daily(val):
@@ -3390,24 +4699,16 @@ else:
             sel_mes = meses_dict[sel_mes_nome]
             days_in_month = pd.Period(f"{sel_ano}-{sel_mes}-01").days_in_month
             dates = [datetime(sel_ano, sel_mes, d) for d in range(1, days_in_month+1)]
-            data_matrix = []
-            for d in dates:
-                row_data = {"Dia": d.strftime("%d/%m")}
-                for servico in SERVICOS_CONSIDERADOS:
-                    people_in_service = df_raw[df_raw[target_col].astype(str).str.contains(servico, case=False, regex=False)]
-                    if people_in_service.empty:
-                            people_in_service = df_raw[df_raw[target_col].astype(str) == servico]
-                    total = len(people_in_service)
-                    absent = 0
-                    for _, person in people_in_service.iterrows():
-                        status = get_status_em_data(person, d, BLOCOS_DATAS)
-                        if status != "Presente":
-                            absent += 1
-                    available = max(0, total - absent)
-                    scale_val = max(0, available - 1)
-                    row_data[servico] = f"{scale_val}x1"
-                data_matrix.append(row_data)
-            df_tabela = pd.DataFrame(data_matrix)
+            # Ausentes por serviço em cada dia do mês = soma das colunas do mês na matriz
+            membros = membros_servicos(df_raw, target_col, SERVICOS_CONSIDERADOS)
+            matriz_ano = matriz_ausencia_ano(DATAS_BLOCOS, BLOCOS_DATAS, len(df_raw), int(sel_ano), VERSAO_DADOS)
+            dia0 = dates[0].timetuple().tm_yday - 1
+            matriz_mes = matriz_ano[:, dia0:dia0 + days_in_month]
+            df_tabela = pd.DataFrame({"Dia": [d.strftime("%d/%m") for d in dates]})
+            for servico in SERVICOS_CONSIDERADOS:
+                mascara = membros[servico]
+                total = int(mascara.sum())
+                df_tabela[servico] = [escala_nx1(total, int(a)) for a in matriz_mes[mascara].sum(axis=0)]
             def color_scale_monthly(val):
                 if isinstance(val, str):
                     if "0x1" in val or "1x1" in val:
@@ -3611,48 +4912,29 @@ else:
         st.subheader("Aniversariantes")
         
         try:
-            df_niver_raw = load_aniversarios()
+            df_trip = load_tripulacao()
             
-            if df_niver_raw.empty:
+            if df_trip.empty:
                 st.info("Não foi possível carregar a lista de aniversariantes.")
             else:
-                # Processar dados
-                # Colunas esperadas: D (Posto), G (Nome), M (Data Nascimento DD/MM/AAAA)
-                
-                # Ajuste de índices (0-based): D=3, G=6, M=12
-                # Cria um DF limpo
-                dados_niver = []
-                
-                # Itera sobre as linhas (pulando header se necessário, mas o read já deve ter tratado)
-                for idx, row in df_niver_raw.iterrows():
-                    try:
-                        posto = row.iloc[3]
-                        nome = row.iloc[6]
-                        data_str = row.iloc[12]  # Coluna M
-                        
-                        if pd.notna(nome) and str(nome).strip() != "" and pd.notna(data_str):
-                            # Parse da data de nascimento completa
-                            dt_nasc = pd.to_datetime(data_str, dayfirst=True, errors='coerce')
-                            if pd.isna(dt_nasc):
-                                dt_nasc = parse_aniversario_date(data_str)
-                            
-                            if pd.notna(dt_nasc):
-                                ano_atual = (datetime.utcnow() - timedelta(hours=3)).year
-                                idade = ano_atual - dt_nasc.year
-                                dt_niver = datetime(ano_atual, dt_nasc.month, dt_nasc.day)
-                                dados_niver.append({
-                                    "Posto": posto,
-                                    "Nome": nome,
-                                    "DataOriginal": data_str,
-                                    "Data": dt_niver,
-                                    "Dia": dt_niver.day,
-                                    "Mês": dt_niver.month,
-                                    "Idade": idade
-                                })
-                    except:
-                        continue
-                        
-                df_aniversarios = pd.DataFrame(dados_niver)
+                # Tripulantes com nome de guerra e data de nascimento válida
+                validos = df_trip[(df_trip["Guerra"] != "") & df_trip["Nascimento"].notna()]
+                ano_atual = (datetime.utcnow() - timedelta(hours=3)).year
+                nasc = validos["Nascimento"]
+                # 29/02 em ano não bissexto vira NaT e é descartado (como antes)
+                dt_niver = pd.to_datetime(
+                    pd.DataFrame({"year": ano_atual, "month": nasc.dt.month, "day": nasc.dt.day}),
+                    errors="coerce"
+                )
+                df_aniversarios = pd.DataFrame({
+                    "Posto": validos["Posto"],
+                    "Nome": validos["Guerra"],
+                    "Data": dt_niver,
+                    "Dia": dt_niver.dt.day,
+                    "Mês": dt_niver.dt.month,
+                    "Idade": ano_atual - nasc.dt.year
+                }).dropna(subset=["Data"])
+                df_aniversarios[["Dia", "Mês"]] = df_aniversarios[["Dia", "Mês"]].astype(int)
                 
                 if df_aniversarios.empty:
                     st.info("Nenhum aniversariante encontrado ou erro no processamento das datas.")
@@ -3894,15 +5176,8 @@ else:
                         df_tempo = load_tempo_bordo()
                         if not df_tempo.empty:
                             hoje = datetime.utcnow() - timedelta(hours=3)
-                            
-                            def calc_anos(val):
-                                dt = parse_sheet_date(val)
-                                if pd.isna(dt): return None
-                                diff = hoje - dt
-                                return diff.days / 365.25
-                            
-                            df_tempo["Anos"] = df_tempo["DataEmbarque"].apply(calc_anos)
-                            df_tempo = df_tempo.dropna(subset=["Anos"])
+                            # Datas já convertidas em load_tripulacao (NaT descartados)
+                            df_tempo["Anos"] = (hoje - df_tempo["DataEmbarque"]).dt.days / 365.25
                             
                             menos_1 = (df_tempo["Anos"] < 1).sum()
                             entre_1_2 = ((df_tempo["Anos"] >= 1) & (df_tempo["Anos"] < 2)).sum()
@@ -4009,35 +5284,16 @@ else:
         st.markdown("Selecione um militar para visualizar todas as informações cadastradas.")
         
         try:
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            # Lê com o header correto para garantir nomes de colunas (linha 7 = header index 6)
-            df_trip = conn.read(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ttl="10m")
-            
-            # Formata nomes das colunas
-            df_trip.columns = [str(c).strip() for c in df_trip.columns]
+            # Ficha completa (todas as colunas) + tripulação tipada, ambas da mesma leitura da aba
+            df_trip = load_tripulacao_raw()
+            df_roster = load_tripulacao()
             
             # A coluna de Nome está no índice 5 (F), Nome de Guerra no 6 (G) e Posto no índice 3 (D)
             if len(df_trip.columns) > 5:
-                nome_col = df_trip.columns[5]
+                df_roster = df_roster[df_roster["Nome"] != ""]
                 
-                df_trip = df_trip.dropna(subset=[nome_col])
-                df_trip = df_trip[df_trip[nome_col].astype(str).str.strip() != ""]
-                
-                # Prepara opções para o selectbox
-                opcoes_militar = []
-                for idx, row in df_trip.iterrows():
-                    nome_completo = str(row.iloc[5]).strip()
-                    nome_guerra = str(row.iloc[6]).strip() if len(row) > 6 else ""
-                    posto = str(row.iloc[3]).strip()
-                    
-                    # Usa o Nome de Guerra se disponível para o selectbox, ou o Nome
-                    nome_exibir = nome_guerra if nome_guerra and nome_guerra.lower() != "nan" else nome_completo
-                    
-                    if posto and posto.lower() != "nan":
-                        desc = f"{posto} {nome_exibir}"
-                    else:
-                        desc = nome_exibir
-                    opcoes_militar.append((idx, desc))
+                # Prepara opções para o selectbox (Posto + Nome de Guerra, ou Nome completo)
+                opcoes_militar = list(zip(df_roster.index, df_roster["Descricao"]))
                 
                 # Selectbox
                 opcoes_desc = [opt[1] for opt in opcoes_militar]
@@ -4091,59 +5347,19 @@ else:
                         
                         texto_exportacao += "\n[CURSOS REGISTRADOS]\n"
                         
-                        df_ofi = conn.read(spreadsheet=URL_ADESTRAMENTO, worksheet="GERAL - OFICIAIS", header=None, ttl="10m")
-                        df_pra = conn.read(spreadsheet=URL_ADESTRAMENTO, worksheet="GERAL - PRAÇAS", header=None, ttl="10m")
+                        matrizes = load_matriz_adestramento()
                         
-                        nome_completo_sel = str(dados_militar.iloc[5]).strip().upper()
-                        nome_guerra_sel = str(dados_militar.iloc[6]).strip().upper() if len(dados_militar) > 6 else ""
-                        
-                        nip_sel = ""
-                        for col in dados_militar.index: 
-                            if "NIP" in str(col).upper():
-                                nip_sel = str(dados_militar[col]).strip()
-                                if nip_sel.endswith(".0"): nip_sel = nip_sel[:-2]
-                                nip_sel = nip_sel.replace(".", "").replace("-", "").replace(" ", "")
-                                break
+                        militar_roster = df_roster.loc[idx_militar]
+                        nome_completo_sel = militar_roster["Nome"].upper()
+                        nome_guerra_sel = militar_roster["Guerra"].upper()
+                        nip_sel = militar_roster["NIP"]
                         
                         cursos_encontrados = []
                         
-                        def mapear_cursos(df_sheet):
-                            encontrados = []
-                            nomes_cursos = []
-                            if df_sheet.shape[0] > 6:
-                                for idx_col in range(4, df_sheet.shape[1]):
-                                    nomes_cursos.append(str(df_sheet.iloc[6, idx_col]).strip())
-                                    
-                            for idx, r_row in df_sheet.iterrows():
-                                if idx < 7: continue
-                                
-                                r_nip = str(r_row.iloc[1]).strip() if df_sheet.shape[1] > 1 else ""
-                                if r_nip.endswith(".0"): r_nip = r_nip[:-2]
-                                r_nip = r_nip.replace(".", "").replace("-", "").replace(" ", "")
-                                
-                                r_nome_g = str(r_row.iloc[2]).strip().upper() if df_sheet.shape[1] > 2 else ""
-                                r_nome_c = str(r_row.iloc[3]).strip().upper() if df_sheet.shape[1] > 3 else ""
-                                
-                                # Verifica correspondência (NIP ou completo ou guerra)
-                                match = False
-                                if nip_sel and r_nip and nip_sel == r_nip: match = True
-                                elif not nip_sel:
-                                    if (r_nome_c == nome_completo_sel and nome_completo_sel != "") or \
-                                       (r_nome_g == nome_guerra_sel and nome_guerra_sel != "") or \
-                                       (r_nome_g in selecionado.upper()):
-                                        match = True
-                                
-                                if match:
-                                   for id_c, val in enumerate(r_row[4:]):
-                                       if str(val) == "1" and id_c < len(nomes_cursos):
-                                           c_name = nomes_cursos[id_c]
-                                           if c_name and c_name.lower() != "nan":
-                                               encontrados.append(c_name)
-                                   break
-                            return encontrados
-                        
-                        cursos_encontrados.extend(mapear_cursos(df_ofi))
-                        cursos_encontrados.extend(mapear_cursos(df_pra))
+                        for m in (matrizes["oficiais"], matrizes["pracas"]):
+                            linha = buscar_militar_matriz(m, nip_sel, nome_completo_sel, nome_guerra_sel, selecionado.upper())
+                            if linha is not None:
+                                cursos_encontrados.extend(cursos_da_linha(m, linha))
                         
                         if len(cursos_encontrados) > 0:
                             for crs in cursos_encontrados:
@@ -4170,47 +5386,21 @@ else:
         st.subheader("Inspeção de Saúde")
         
         try:
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            # Lê aba de tripulação
-            df_trip = conn.read(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ttl="10m")
-            
-            dados_is = []
+            df_trip = load_tripulacao()
             hoje = (datetime.utcnow() - timedelta(hours=3)).date()
             
-            for idx, row in df_trip.iterrows():
-                try:
-                    posto = str(row.iloc[3]).strip() if len(row) > 3 else ""
-                    nome_completo = str(row.iloc[5]).strip() if len(row) > 5 else ""
-                    nome_guerra = str(row.iloc[6]).strip() if len(row) > 6 else ""
-                    is_str = str(row.iloc[10]).strip() if len(row) > 10 else ""
-                    
-                    if not nome_completo or nome_completo.lower() == "nan":
-                        continue
-                        
-                    nome_exibir = nome_guerra if nome_guerra and nome_guerra.lower() != "nan" else nome_completo
-                    if posto and posto.lower() != "nan":
-                        desc = f"{posto} {nome_exibir}"
-                    else:
-                        desc = nome_exibir
-                        
-                    if pd.notna(is_str) and is_str != "" and is_str.lower() != "nan":
-                        # Tenta converter
-                        dt_is = pd.to_datetime(is_str, dayfirst=True, errors='coerce')
-                        if pd.notna(dt_is):
-                            dados_is.append({
-                                "Militar": desc,
-                                "DataOriginal": is_str,
-                                "DataIS": dt_is.date(),
-                                "DiasDiff": (dt_is.date() - hoje).days
-                            })
-                except Exception as loop_e:
-                    continue
+            # Tripulantes com nome e data de IS válida
+            com_is = df_trip[(df_trip["Nome"] != "") & df_trip["IS"].notna()]
+            df_is = pd.DataFrame({
+                "Militar": com_is["Descricao"],
+                "DataOriginal": com_is["ISTexto"],
+                "DataIS": com_is["IS"].dt.date,
+                "DiasDiff": (com_is["IS"].dt.normalize() - pd.Timestamp(hoje)).dt.days
+            })
                     
-            if not dados_is:
+            if df_is.empty:
                 st.info("Nenhuma data de inspeção de saúde encontrada na planilha.")
             else:
-                df_is = pd.DataFrame(dados_is)
-                
                 # 1. Vencidos (DiasDiff < 0)
                 vencidos = df_is[df_is["DiasDiff"] < 0].sort_values("DiasDiff")
                 
@@ -4271,44 +5461,15 @@ else:
         st.subheader("Organograma do Navio")
         
         try:
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            # Lê aba de tripulação
-            df_trip = conn.read(spreadsheet=URL_ANIVERSARIOS, worksheet="TRIPULAÇÃO", header=6, ttl="10m")
-            
-            tripulantes = []
+            df_trip = load_tripulacao()
+            df_org = df_trip[df_trip["Nome"] != ""]
             
-            # Formata colunas para evitar erros de espaço em branco (Padrão mantido do app.py)
-            df_trip.columns = [str(c).strip() for c in df_trip.columns]
-            
-            for idx, row in df_trip.iterrows():
-                try:
-                    # Índices: Posto=3 (D), Nome=5 (F), Nome de Guerra=6 (G), Divisão=16 (Q)
-                    if len(row) > 16:
-                        posto = str(row.iloc[3]).strip()
-                        nome_completo = str(row.iloc[5]).strip()
-                        nome_guerra = str(row.iloc[6]).strip()
-                        divisao = str(row.iloc[16]).strip().lower()
-                        situacao = str(row.iloc[17]).strip().lower() if len(row) > 17 else ""
-                        
-                        if not nome_completo or nome_completo.lower() == "nan":
-                            continue
-                            
-                        nome_exibir = nome_guerra if nome_guerra and nome_guerra.lower() != "nan" else nome_completo
-                        
-                        if posto and posto.lower() != "nan":
-                            desc = f"{posto} {nome_exibir}"
-                        else:
-                            desc = nome_exibir
-                            
-                        if "destacado" in situacao:
-                            desc += " (Destacado)"
-                            
-                        tripulantes.append({
-                            "Nome": desc,
-                            "Divisao": divisao
-                        })
-                except Exception:
-                    continue
+            destacado = df_org["Situação"].str.lower().str.contains("destacado", regex=False)
+            nomes_org = df_org["Descricao"].where(~destacado, df_org["Descricao"] + " (Destacado)")
+            tripulantes = [
+                {"Nome": nome, "Divisao": divisao}
+                for nome, divisao in zip(nomes_org, df_org["Divisão"].str.lower())
+            ]
                     
             if len(tripulantes) >= 2:
                 comandante = tripulantes[0]
@@ -4321,70 +5482,11 @@ else:
                 div_ope = [t for t in outros if "ope" in t["Divisao"]]
                 div_maq = [t for t in outros if "maq" in t["Divisao"]]
                 
-                # CSS do Organograma
-                st.markdown("""
-                <style>
-                    .org-node {
-                        background-color: rgba(255, 255, 255, 0.07);
-                        border: 1px solid rgba(128, 128, 128, 0.2);
-                        border-radius: 8px;
-                        padding: 15px;
-                        text-align: center;
-                        margin: 10px auto;
-                        width: 90%;
-                        font-weight: 600;
-                        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                        transition: transform 0.2s;
-                    }
-                    .org-node:hover {
-                        transform: scale(1.02);
-                    }
-                    .cmd-node { width: 50%; max-width: 300px; border-top: 4px solid #f97316; }
-                    .imed-node { width: 50%; max-width: 300px; border-top: 4px solid #3b82f6; }
-                    .arm-node { border-left: 4px solid #ef4444; }
-                    .ope-node { border-left: 4px solid #10b981; }
-                    .maq-node { border-left: 4px solid #8b5cf6; }
-                    .div-title {
-                        text-align: center;
-                        font-size: 1.1rem;
-                        font-weight: 600;
-                        margin-bottom: 15px;
-                        color: var(--text-color);
-                        opacity: 0.9;
-                        border-bottom: 2px solid rgba(128,128,128,0.2);
-                        padding-bottom: 5px;
-                    }
-                </style>
-                """, unsafe_allow_html=True)
-                
-                # Renderiza Comandante
-                st.markdown(f'<div class="org-node cmd-node">Comandante<br><span style="font-weight:normal;font-size:0.9em;opacity:0.8;">{comandante["Nome"]}</span></div>', unsafe_allow_html=True)
-                
-                # Linha conectora vertical
-                st.markdown("<div style='text-align: center; font-size: 24px; color: var(--text-color); opacity: 0.4;'>↓</div>", unsafe_allow_html=True)
-                
-                # Renderiza Imediato
-                st.markdown(f'<div class="org-node imed-node">Imediato<br><span style="font-weight:normal;font-size:0.9em;opacity:0.8;">{imediato["Nome"]}</span></div>', unsafe_allow_html=True)
-                
-                st.markdown("<div style='text-align: center; font-size: 24px; color: var(--text-color); opacity: 0.4; margin-bottom: 30px;'>↓</div>", unsafe_allow_html=True)
-                
-                # Branch out (3 Divisions)
-                c1, c2, c3 = st.columns(3)
-                
-                with c1:
-                    st.markdown('<div class="div-title" style="border-bottom-color: #ef4444;">Divisão de Armamento</div>', unsafe_allow_html=True)
-                    for m in div_arm:
-                        st.markdown(f'<div class="org-node arm-node" style="font-size:0.9em; font-weight:normal;">{m["Nome"]}</div>', unsafe_allow_html=True)
-                        
-                with c2:
-                    st.markdown('<div class="div-title" style="border-bottom-color: #10b981;">Divisão de Operações</div>', unsafe_allow_html=True)
-                    for m in div_ope:
-                        st.markdown(f'<div class="org-node ope-node" style="font-size:0.9em; font-weight:normal;">{m["Nome"]}</div>', unsafe_allow_html=True)
-                        
-                with c3:
-                    st.markdown('<div class="div-title" style="border-bottom-color: #8b5cf6;">Divisão de Máquinas</div>', unsafe_allow_html=True)
-                    for m in div_maq:
-                        st.markdown(f'<div class="org-node maq-node" style="font-size:0.9em; font-weight:normal;">{m["Nome"]}</div>', unsafe_allow_html=True)
+                st.markdown(html_organograma(comandante, imediato, [
+                    ("Divisão de Armamento", "#ef4444", "arm-node", div_arm),
+                    ("Divisão de Operações", "#10b981", "ope-node", div_ope),
+                    ("Divisão de Máquinas", "#8b5cf6", "maq-node", div_maq),
+                ]), unsafe_allow_html=True)
                         
             else:
                 st.warning("Não há tripulantes suficientes listados para montar o organograma.")
@@ -4393,6 +5495,9 @@ else:
             st.error(f"Erro ao carregar dados do Organograma: {e}")
 
     elif pagina == "Log / Debug":
+        df_raw = obter_df_raw()
+        BLOCOS_DATAS = obter_blocos()
+        df_eventos, INDICE_EVENTOS = obter_eventos()
         st.subheader("Log / Debug")
         
         # --- NEW DEBUG SECTION FOR CHECKBOXES ---
@@ -4419,6 +5524,15 @@ else:
             
         st.markdown("---")
     
+        st.markdown("### Memória dos DataFrames")
+        linhas_memoria = []
+        for nome_df, df_mem in (("df_raw", df_raw), ("df_eventos", df_eventos)):
+            antes_mb, depois_mb = df_mem.attrs.get("memoria_mb", (memoria_mb(df_mem), memoria_mb(df_mem)))
+            linhas_memoria.append({"DataFrame": nome_df, "Linhas": len(df_mem), "Antes (MB)": round(antes_mb, 3), "Depois (MB)": round(depois_mb, 3)})
+        st.dataframe(pd.DataFrame(linhas_memoria), use_container_width=True, hide_index=True)
+        st.write("Tipos em df_eventos:", df_eventos.dtypes.astype(str).to_dict())
+        st.markdown("---")
+
         st.markdown("### df_raw (dados brutos do Google Sheets)")
         st.write(f"Total de linhas em df_raw: **{len(df_raw)}**")
         st.write("Colunas disponíveis em df_raw:")
@@ -4437,6 +5551,16 @@ else:
             st.info("Nenhum bloco de datas detectado.")
         st.markdown("---")
     
+        st.markdown("### Mudanças na planilha desde a última atualização")
+        mudancas, atualizado_em = mudancas_eventos()
+        if atualizado_em is not None:
+            st.caption(f"Última atualização com mudanças: {atualizado_em.strftime('%d/%m/%Y %H:%M:%S')}")
+        if mudancas:
+            st.dataframe(pd.DataFrame(mudancas), use_container_width=True, hide_index=True)
+        else:
+            st.info("Nenhuma linha incluída, alterada ou removida desde a carga inicial.")
+        st.markdown("---")
+
         st.markdown("### df_eventos (eventos gerados)")
         st.write(f"Total de eventos em df_eventos: **{len(df_eventos)}**")
         if not df_eventos.empty:
@@ -4454,7 +5578,7 @@ else:
     
         st.markdown("### 🎂 O QUE O APP ESTÁ LENDO AGORA (URL_ANIVERSARIOS default)")
         try:
-            df_niver_debug = load_aniversarios()
+            df_niver_debug = load_tripulacao_raw()
             st.write(f"**Shape:** {df_niver_debug.shape}")
             st.write(f"**Colunas ({len(df_niver_debug.columns)}):**")
             for i, col in enumerate(df_niver_debug.columns):